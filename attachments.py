@@ -0,0 +1,245 @@
+# attachments.py
+# Note attachments in GridFS (one shared bucket, owner and note in each file's
+# metadata). Notes only hold references: {id, filename, content_type, size}.
+#
+# Uploads are multipart/form-data parsed incrementally as the body arrives;
+# each file part is written straight into a GridFS upload stream, so memory
+# per upload is one network chunk whatever the file size. Downloads stream
+# GridFS chunks back with a strong ETag (files are immutable) and single-range
+# support (206 / 416, If-Range), which lets clients resume and seek media.
+import os
+from urllib.parse import quote
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from python_multipart.multipart import MultipartParser, parse_options_header
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from database import get_app_db
+import indexes
+import storage
+
+BUCKET_NAME = storage.ATTACHMENTS_BUCKET
+indexes.declare("app", f"{BUCKET_NAME}.files", [("metadata.owner", 1), ("metadata.note_id", 1)])
+
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))  # per file
+ATTACHMENT_MAX_FILES = int(os.getenv("ATTACHMENT_MAX_FILES", "10"))  # per upload request
+ATTACHMENT_CHUNK_BYTES = int(os.getenv("ATTACHMENT_CHUNK_BYTES", str(255 * 1024)))  # GridFS chunk size
+
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+# Shown in the browser; anything else (HTML, SVG, ...) is served as a download
+INLINE_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp", "application/pdf", "audio/", "video/", "text/plain")
+
+
+def get_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(get_app_db(), bucket_name=BUCKET_NAME, chunk_size_bytes=ATTACHMENT_CHUNK_BYTES)
+
+
+def get_files_collection():
+    return get_app_db()[f"{BUCKET_NAME}.files"]
+
+
+def parse_id(value: str) -> ObjectId:
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=404, detail=f"Attachment not found with id {value}")
+
+
+# ================= Upload =================
+class _PartCollector:
+    """
+    Callbacks for MultipartParser. The parser is synchronous and reuses its
+    buffer, so events are copied out here and replayed (with the async GridFS
+    writes) after each chunk of the body has been fed in.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._field = b""
+        self._value = b""
+        self._headers = {}
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._add("_field", data[start:end]),
+            "on_header_value": lambda data, start, end: self._add("_value", data[start:end]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": lambda: self.events.append(("headers", self._headers)),
+            "on_part_data": lambda data, start, end: self.events.append(("data", bytes(data[start:end]))),
+            "on_part_end": lambda: self.events.append(("end", None)),
+        }
+
+    def _add(self, attr: str, chunk: bytes):
+        setattr(self, attr, getattr(self, attr) + chunk)
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_end(self):
+        self._headers[self._field.decode("latin-1").lower()] = self._value.decode("latin-1")
+        self._field, self._value = b"", b""
+
+    def drain(self) -> list:
+        events, self.events = self.events, []
+        return events
+
+
+def _boundary(request: Request) -> bytes:
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=415, detail="Expected a multipart/form-data body")
+    return params[b"boundary"]
+
+
+def _filename(headers: dict) -> str | None:
+    _, params = parse_options_header(headers.get("content-disposition", ""))
+    filename = params.get(b"filename")
+    if filename is None:
+        return None
+    # Browsers send UTF-8 here; keep only the base name of whatever path was given
+    return filename.decode("utf-8", "replace").replace("\\", "/").rsplit("/", 1)[-1] or "file"
+
+
+async def receive_files(request: Request, owner: str, note_id: str) -> list:
+    """
+    Stream every file part of the request body into GridFS; returns their
+    references. Form fields without a filename are ignored. On any error the
+    files written so far are removed again.
+    """
+    collector = _PartCollector()
+    parser = MultipartParser(_boundary(request), collector.callbacks())
+    bucket = get_bucket()
+    saved, stream, ref = [], None, None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, value in collector.drain():
+                if kind == "headers":
+                    filename = _filename(value)
+                    if filename is None:
+                        continue
+                    if len(saved) >= ATTACHMENT_MAX_FILES:
+                        raise HTTPException(status_code=400, detail=f"Too many files (max {ATTACHMENT_MAX_FILES})")
+                    content_type = value.get("content-type") or DEFAULT_CONTENT_TYPE
+                    stream = bucket.open_upload_stream(filename, metadata={
+                        "owner": owner, "note_id": note_id, "content_type": content_type,
+                    })
+                    ref = {"id": str(stream._id), "filename": filename, "content_type": content_type, "size": 0}
+                elif kind == "data" and stream is not None:
+                    ref["size"] += len(value)
+                    if ref["size"] > ATTACHMENT_MAX_BYTES:
+                        raise HTTPException(status_code=413, detail=f"File too large (max {ATTACHMENT_MAX_BYTES} bytes)")
+                    await stream.write(value)
+                elif kind == "end" and stream is not None:
+                    await stream.close()
+                    saved.append(ref)
+                    stream, ref = None, None
+        parser.finalize()
+        if stream is not None:
+            raise HTTPException(status_code=400, detail="Incomplete multipart body")
+    except BaseException:
+        if stream is not None:
+            await stream.abort()
+        await delete_files([r["id"] for r in saved])
+        raise
+    return saved
+
+
+# ================= Download =================
+async def open_file(owner: str, note_id: str, attachment_id: str):
+    """Open a stored file for reading (one query), if it belongs to this owner's note."""
+    try:
+        grid_out = await get_bucket().open_download_stream(parse_id(attachment_id))
+    except NoFile:
+        grid_out = None
+    metadata = (grid_out.metadata or {}) if grid_out else {}
+    if metadata.get("owner") != owner or metadata.get("note_id") != note_id:
+        raise HTTPException(status_code=404, detail=f"Attachment not found with id {attachment_id}")
+    return grid_out
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    (first, last) byte positions for a single "bytes=" range, or None to send
+    the whole file (no header, or several ranges). Raises 416 if unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:  # suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None  # malformed ranges are ignored
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def download_response(grid_out, request: Request) -> Response:
+    """Stream an opened file (or the requested range of it)."""
+    size = grid_out.length
+    etag = f'"{grid_out._id}"'
+    filename = quote(grid_out.filename or "file")
+    content_type = grid_out.metadata.get("content_type", DEFAULT_CONTENT_TYPE)
+    disposition = "inline" if content_type.startswith(INLINE_TYPES) else "attachment"
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Content-Disposition": f"{disposition}; filename*=UTF-8''{filename}",
+        "X-Content-Type-Options": "nosniff",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:  # a stale If-Range gets the whole file
+        byte_range = parse_range(request.headers.get("range"), size)
+    start, end = byte_range or (0, size - 1)
+    status = 200
+    if byte_range is not None:
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+
+    async def body():
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await grid_out.read(min(grid_out.chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    return StreamingResponse(body(), status_code=status, media_type=content_type, headers=headers)
+
+
+# ================= Delete =================
+async def delete_files(file_ids: list):
+    if not file_ids:
+        return
+    oids = [ObjectId(i) for i in file_ids]
+    db = get_app_db()
+    # File documents first: a crash in between leaves unreachable chunks, never a broken file
+    await db[f"{BUCKET_NAME}.files"].delete_many({"_id": {"$in": oids}})
+    await db[f"{BUCKET_NAME}.chunks"].delete_many({"files_id": {"$in": oids}})
+
+
+async def delete_for_notes(owner: str, note_ids: list):
+    """Remove the stored files of deleted notes, in a fixed number of queries whatever the count."""
+    if not note_ids:
+        return
+    cursor = get_files_collection().find(
+        {"metadata.owner": owner, "metadata.note_id": {"$in": [str(n) for n in note_ids]}}, {"_id": 1})
+    await delete_files([str(doc["_id"]) async for doc in cursor])
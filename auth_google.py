@@ -1,12 +1,13 @@
 from fastapi import APIRouter, HTTPException
-import httpx, os
+import asyncio, os, re, time
+import jwt
 from urllib.parse import urlencode
-from dotenv import load_dotenv
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
 from datetime import timedelta
-from authent import users_collection, create_access_token  # Import from your authent.py
+from authent import get_users_collection, create_access_token, invalidate_cached_user  # Import from your authent.py
 from fastapi.responses import RedirectResponse
-
-load_dotenv()
+from http_client import get_http_client
+from pymongo.errors import DuplicateKeyError
 
 router = APIRouter(prefix="/auth/google", tags=["Google Auth"])
 
@@ -14,6 +15,68 @@ CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI")
 
+# Verify the id_token from the token response locally instead of calling userinfo.
+# Needs PyJWT's RSA support (the "cryptography" package).
+VERIFY_ID_TOKEN = os.getenv("GOOGLE_VERIFY_ID_TOKEN", "0") == "1"
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v3/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+JWKS_DEFAULT_TTL_SECONDS = int(os.getenv("GOOGLE_JWKS_TTL_SECONDS", "3600"))
+JWKS_MIN_REFRESH_SECONDS = 60  # rate limit for refreshes triggered by an unknown kid
+
+
+# ================= Google signing keys =================
+class JWKSCache:
+    """Google's signing keys, refreshed when stale (per Cache-Control) or on an unknown kid."""
+
+    def __init__(self, url: str = GOOGLE_CERTS_URL):
+        self.url = url
+        self.keys = {}
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        res = await get_http_client().get(self.url)
+        res.raise_for_status()
+        self.keys = {k["kid"]: jwt.PyJWK(k) for k in res.json().get("keys", [])}
+        match = re.search(r"max-age=(\d+)", res.headers.get("cache-control", ""))
+        ttl = int(match.group(1)) if match else JWKS_DEFAULT_TTL_SECONDS
+        self.fetched_at = time.monotonic()
+        self.expires_at = self.fetched_at + ttl
+
+    def _needs_refresh(self, kid: str) -> bool:
+        now = time.monotonic()
+        if now >= self.expires_at:
+            return True
+        return kid not in self.keys and now - self.fetched_at >= JWKS_MIN_REFRESH_SECONDS
+
+    async def get_key(self, kid: str):
+        if self._needs_refresh(kid):
+            async with self._lock:
+                if self._needs_refresh(kid):  # another request may have refreshed while we waited
+                    await self.refresh()
+        return self.keys.get(kid)
+
+
+google_jwks = JWKSCache()
+
+
+async def verify_id_token(id_token: str) -> dict:
+    """Validate signature, audience, issuer and expiry of a Google id_token; return its claims."""
+    try:
+        kid = jwt.get_unverified_header(id_token).get("kid")
+        key = await google_jwks.get_key(kid)
+        if key is None:
+            raise HTTPException(status_code=401, detail="Unknown Google signing key")
+        claims = jwt.decode(id_token, key.key, algorithms=["RS256"], audience=CLIENT_ID)
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid Google id_token")
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise HTTPException(status_code=401, detail="Invalid Google id_token issuer")
+    if claims.get("email") and not claims.get("email_verified", False):
+        raise HTTPException(status_code=400, detail="Google email not verified")
+    return claims
+
 
 # @router.get("/")
 # async def google_login():
@@ -55,11 +118,15 @@ async def google_callback(code: str):
         "grant_type": "authorization_code",
     }
 
-    async with httpx.AsyncClient() as client:
-        token_res = await client.post(token_url, data=data)
-        token_res.raise_for_status()
-        tokens = token_res.json()
+    client = get_http_client()
+    token_res = await client.post(token_url, data=data)
+    token_res.raise_for_status()
+    tokens = token_res.json()
 
+    if VERIFY_ID_TOKEN and tokens.get("id_token"):
+        # id_token already carries email/name/picture for the "openid email profile" scope
+        user_info = await verify_id_token(tokens["id_token"])
+    else:
         user_info_url = "https://www.googleapis.com/oauth2/v2/userinfo"
         headers = {"Authorization": f"Bearer {tokens['access_token']}"}
         user_res = await client.get(user_info_url, headers=headers)
@@ -71,7 +138,7 @@ async def google_callback(code: str):
     if not email:
         raise HTTPException(status_code=400, detail="No email from Google account")
 
-    existing_user = await users_collection.find_one({"email": email})
+    existing_user = await get_users_collection().find_one({"email": email})
 
     if not existing_user:
         # Create a new user document
@@ -80,12 +147,14 @@ async def google_callback(code: str):
             "email": email,
             "password": None,  # no password since it's Google
             "auth_provider": "google",
-            "otp": None,
-            "otpExpires": None,
         }
-        await users_collection.insert_one(new_user)
+        try:
+            await get_users_collection().insert_one(new_user)
+        except DuplicateKeyError:
+            pass  # created by a concurrent login; the unique email index kept it to one
     else:
         new_user = existing_user
+    invalidate_cached_user(email)
 
     # Create JWT token
     token = create_access_token(
@@ -1,40 +1,51 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request
 from datetime import datetime, timedelta
-from email.message import EmailMessage
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from dotenv import load_dotenv
-import os, random, smtplib, jwt
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+import os, random, jwt
+from pymongo.errors import DuplicateKeyError
 from models import UserCreate, UserLogin, ForgotPassword, VerifyOTP, ResetPassword
-
-load_dotenv()
+from database import get_auth_db
+from cache import TTLCache
+from mailer import outbox
+import indexes
+import passwords
 
 router = APIRouter(prefix="/api", tags=["Authentication"])
 
-MONGO_URI = os.getenv("MONGO_URI")
-EMAIL_USER = os.getenv("EMAIL_USER")
-EMAIL_PASS = os.getenv("EMAIL_PASS")
 SECRET_KEY = os.getenv("JWT_SECRET", "replace_this_with_a_real_secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-client = AsyncIOMotorClient(MONGO_URI)
-db = client["test"]
-users_collection = db["users"]
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+OTP_TTL_MINUTES = 10
+
+# Password-reset codes live in their own collection, one per email (_id), so a
+# TTL index can expire them without touching user documents.
+OTPS_COLLECTION = "password_otps"
+
+indexes.declare("auth", "users", [("email", 1)], unique=True, name="email_unique")
+indexes.declare("auth", OTPS_COLLECTION, "expires_at", expireAfterSeconds=0)
+
+# Authenticated user docs by email, minus secrets. Per worker, so keep the TTL short.
+# (otp/otpExpires only exist on users who requested a reset before OTPS_COLLECTION.)
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+USER_CACHE_PROJECTION = {"password": 0, "otp": 0, "otpExpires": 0}
+
+
+def get_users_collection():
+    return get_auth_db()["users"]
+
+
+def get_otps_collection():
+    return get_auth_db()[OTPS_COLLECTION]
+
 
 # ================= Helper Functions =================
 async def send_email(to_email: str, subject: str, body: str):
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = EMAIL_USER
-    msg["To"] = to_email
-    msg.set_content(body)
-    try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.send_message(msg)
-    except Exception:
-        raise HTTPException(status_code=500, detail="Email delivery failed")
+    """Hand the message to the outbox; delivery and retries happen off the request path."""
+    await outbox.enqueue(to_email, subject, body)
 
 
 def create_access_token(subject: str, expires_delta: timedelta | None = None):
@@ -43,6 +54,11 @@ def create_access_token(subject: str, expires_delta: timedelta | None = None):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def invalidate_cached_user(email: str):
+    """Drop a cached user after any write to their record."""
+    user_cache.invalidate(email)
+
+
 security = HTTPBearer()
 
 
@@ -58,38 +74,52 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = await users_collection.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    user = user_cache.get(email)
+    if user is None:
+        user = await get_users_collection().find_one({"email": email}, USER_CACHE_PROJECTION)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        user_cache.set(email, user)
     return user
 
 
 # ================= Routes =================
 @router.post("/signup")
 async def signup(user: UserCreate, background_tasks: BackgroundTasks):
-    existing_user = await users_collection.find_one({"email": user.email})
+    existing_user = await get_users_collection().find_one({"email": user.email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user_dict = user.dict()
-    user_dict["otp"] = None
-    user_dict["otpExpires"] = None
-    await users_collection.insert_one(user_dict)
+    user_dict["password"] = await passwords.hash_password(user.password)
+    try:
+        await get_users_collection().insert_one(user_dict)
+    except DuplicateKeyError:  # a concurrent signup for the same email won the race
+        raise HTTPException(status_code=400, detail="Email already registered")
+    invalidate_cached_user(user.email)
 
     background_tasks.add_task(
         send_email,
         user.email,
         "Welcome!",
-        f"Hi {user.name}, signup successful. Your password: {user.password}"
+        f"Hi {user.name}, signup successful."
     )
     return {"message": "User registered successfully"}
 
 
 @router.post("/login")
 async def login(data: UserLogin):
-    user = await users_collection.find_one({"email": data.email})
-    if not user or user["password"] != data.password:
+    user = await get_users_collection().find_one({"email": data.email})
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    ok, new_hash = await passwords.verify_password(data.password, user.get("password"))
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Plaintext record or outdated cost: upgrade it, unless it changed meanwhile
+        await get_users_collection().update_one(
+            {"_id": user["_id"], "password": user["password"]}, {"$set": {"password": new_hash}}
+        )
 
     token = create_access_token(subject=user["email"])
     return {"message": "Login successful", "token": token, "name": user.get("name", "")}
@@ -97,15 +127,16 @@ async def login(data: UserLogin):
 
 @router.post("/forgot-password")
 async def forgot_password(data: ForgotPassword, background_tasks: BackgroundTasks):
-    user = await users_collection.find_one({"email": data.email})
+    user = await get_users_collection().find_one({"email": data.email})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     otp = str(random.randint(100000, 999999))
-    otp_expires = datetime.utcnow() + timedelta(minutes=10)
-    await users_collection.update_one(
-        {"email": data.email},
-        {"$set": {"otp": otp, "otpExpires": otp_expires}}
+    otp_expires = datetime.utcnow() + timedelta(minutes=OTP_TTL_MINUTES)
+    await get_otps_collection().update_one(
+        {"_id": data.email},
+        {"$set": {"otp": otp, "expires_at": otp_expires}},
+        upsert=True,
     )
     background_tasks.add_task(send_email, data.email, "Password Reset OTP", f"Your OTP is: {otp}")
     return {"message": "OTP sent"}
@@ -113,23 +144,26 @@ async def forgot_password(data: ForgotPassword, background_tasks: BackgroundTask
 
 @router.post("/verify-otp")
 async def verify_otp(data: VerifyOTP):
-    user = await users_collection.find_one({"email": data.email, "otp": data.otp})
-    if not user:
+    entry = await get_otps_collection().find_one({"_id": data.email, "otp": data.otp})
+    if not entry:
         raise HTTPException(status_code=400, detail="Invalid email or OTP")
-    if user["otpExpires"] < datetime.utcnow():
+    # The TTL monitor only runs about once a minute, so check expiry here as well
+    if entry["expires_at"] < datetime.utcnow():
         raise HTTPException(status_code=400, detail="Expired OTP")
 
-    await users_collection.update_one({"email": data.email}, {"$set": {"otp": None, "otpExpires": None}})
+    await get_otps_collection().delete_one({"_id": data.email})
     return {"message": "OTP verified"}
 
 
 @router.post("/reset-password")
 async def reset_password(data: ResetPassword):
-    user = await users_collection.find_one({"email": data.email})
+    user = await get_users_collection().find_one({"email": data.email})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    await users_collection.update_one({"email": data.email}, {"$set": {"password": data.password}})
+    hashed = await passwords.hash_password(data.password)
+    await get_users_collection().update_one({"email": data.email}, {"$set": {"password": hashed}})
+    invalidate_cached_user(data.email)
     return {"message": "Password reset successfully"}
 
 
@@ -139,10 +173,17 @@ async def protected_route(current_user=Depends(get_current_user)):
 
 
 @router.get("/health")
-async def health_check():
+async def health_check(request: Request):
     try:
-        await db.command("ping")
-        return {"status": "ok", "message": "Connected to MongoDB successfully!"}
+        await get_auth_db().command("ping")
+        return {
+            "status": "ok",
+            "message": "Connected to MongoDB successfully!",
+            "user_cache": user_cache.stats(),
+            "email_outbox": outbox.stats(),
+            "password_hashing": passwords.stats(),
+            "startup": getattr(request.app.state, "startup", None),
+        }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -0,0 +1,80 @@
+# benchmarks/bench_compression.py
+# Bytes on the wire against server time for note lists, per Accept-Encoding
+# (identity and each of COMPRESSION_ENCODINGS). "link ms" is the transfer time
+# of those bytes at --kbps, so the last column shows what a client on a slow
+# mobile link would wait in total.
+#
+#   python -m benchmarks.bench_compression [--notes 20,200,1000] [--repeat 20] [--kbps 1600]
+import argparse
+import asyncio
+import random
+import time
+
+import http_compression
+import notes
+from benchmarks.harness import bench_app
+
+WORDS = ("meeting", "groceries", "project", "deadline", "ideas", "call", "review", "draft", "budget",
+         "travel", "notes", "follow", "up", "with", "the", "team", "about", "next", "week", "plan")
+
+
+def _note(rng: random.Random, i: int) -> dict:
+    body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 150)))
+    return {"title": f"Note {i}: {rng.choice(WORDS)} {rng.choice(WORDS)}", "content": body}
+
+
+async def _seed(username: str, n: int, seed: int = 1):
+    rng = random.Random(seed)
+    await notes.get_user_collection(username).insert_many([_note(rng, i) for i in range(n)])
+
+
+def _encodings() -> list:
+    # Each one offered alone, so the server's preference order doesn't pick for us
+    return ["identity"] + http_compression.COMPRESSION_ENCODINGS
+
+
+async def run(sizes: list, repeat: int, kbps: int) -> list:
+    rows = []
+    async with bench_app() as (http, counter):
+        for n in sizes:
+            username = f"bench_compression_{n}"
+            await _seed(username, n)
+            for encoding in _encodings():
+                headers = {"Accept-Encoding": encoding}
+                url = f"/api/notes?username={username}"
+                await http.get(url, headers=headers)  # warm-up
+                timings, wire = [], 0
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    res = await http.get(url, headers=headers)
+                    timings.append(time.perf_counter() - start)
+                    res.raise_for_status()
+                    wire = res.num_bytes_downloaded
+                server_ms = 1000 * sum(timings) / len(timings)
+                link_ms = wire * 8 / kbps  # bits / (kbit/s) = ms
+                rows.append({"notes": n, "encoding": encoding, "bytes": wire,
+                             "server_ms": server_ms, "link_ms": link_ms, "total_ms": server_ms + link_ms})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--notes", default="20,200,1000", help="comma-separated list sizes")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--kbps", type=int, default=1600, help="client link speed")
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.notes.split(",") if n.strip()]
+    rows = asyncio.run(run(sizes, args.repeat, args.kbps))
+    print(f"{'notes':>6} {'encoding':<9} {'bytes':>10} {'ratio':>6} {'server ms':>10} {'link ms':>9} {'total ms':>9}")
+    identity = {}
+    for row in rows:
+        if row["encoding"] == "identity":
+            identity[row["notes"]] = row["bytes"]
+        ratio = row["bytes"] / identity[row["notes"]] if identity.get(row["notes"]) else 1.0
+        print(f"{row['notes']:>6} {row['encoding']:<9} {row['bytes']:>10} {ratio:>6.2f} "
+              f"{row['server_ms']:>10.2f} {row['link_ms']:>9.1f} {row['total_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
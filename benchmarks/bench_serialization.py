@@ -0,0 +1,75 @@
+# benchmarks/bench_serialization.py
+# Response encoding cost on large payloads: the trusted path (serializer ->
+# orjson) against the validated one (serializer -> response_model /
+# jsonable_encoder -> encoder), toggled with the routers' TRUSTED_RESPONSES.
+#
+#   python -m benchmarks.bench_serialization [--items 1000] [--repeat 20]
+import argparse
+import asyncio
+
+import notes
+import todos
+from benchmarks.harness import bench_app, measure
+
+
+def _items(n: int) -> list:
+    return [
+        {"id": i + 1, "text": f"Item {i} " + "x" * 40, "done": i % 3 == 0,
+         "reminderDate": "2024-01-01" if i % 10 == 0 else "", "reminderTime": ""}
+        for i in range(n)
+    ]
+
+
+async def _seed(http, username: str, n: int) -> str:
+    res = await http.post(f"/api/todos?username={username}", json={"title": "Big list", "items": _items(n)})
+    block_id = res.json()["id"]
+    for i in range(n):
+        await todos.get_user_collection(username).insert_one({"title": f"Block {i}", "items": _items(3)})
+        await notes.get_user_collection(username).insert_one({"title": f"Note {i}", "content": "lorem ipsum " * 30})
+    return block_id
+
+
+def _set_trusted(value: bool):
+    todos.TRUSTED_RESPONSES = value
+    notes.TRUSTED_RESPONSES = value
+
+
+async def run(n: int, repeat: int) -> list:
+    rows = []
+    async with bench_app() as (http, counter):
+        username = "bench_serialization"
+        block_id = await _seed(http, username, n)
+        cases = [
+            (f"GET /api/todos/{{id}} ({n} items)", f"/api/todos/{block_id}?username={username}"),
+            (f"GET /api/todos ({n + 1} blocks)", f"/api/todos?username={username}"),
+            (f"GET /api/notes ({n} notes)", f"/api/notes?username={username}"),
+        ]
+        original = todos.TRUSTED_RESPONSES, notes.TRUSTED_RESPONSES
+        try:
+            for label, url in cases:
+                row = {"case": label}
+                for mode, trusted in (("validated", False), ("trusted", True)):
+                    _set_trusted(trusted)
+                    await http.get(url)  # warm-up
+                    row[mode] = (await measure(http, counter, "GET", url, repeat=repeat))["mean_ms"]
+                rows.append(row)
+        finally:
+            todos.TRUSTED_RESPONSES, notes.TRUSTED_RESPONSES = original
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args.items, args.repeat))
+    print(f"{'case':<34} {'validated ms':>13} {'trusted ms':>11} {'speedup':>8}")
+    for row in rows:
+        speedup = row["validated"] / row["trusted"] if row["trusted"] else float("inf")
+        print(f"{row['case']:<34} {row['validated']:>13.2f} {row['trusted']:>11.2f} {speedup:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
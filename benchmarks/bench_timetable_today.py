@@ -0,0 +1,59 @@
+# benchmarks/bench_timetable_today.py
+# Regression benchmark: GET /api/timetable/today must cost a constant number of
+# round trips regardless of how many slots the day has.
+#
+#   python -m benchmarks.bench_timetable_today [--check]
+import argparse
+import asyncio
+import sys
+
+from benchmarks.harness import bench_app, measure
+
+SLOT_COUNTS = [1, 5, 20, 50]
+
+
+def _template(n_slots: int) -> dict:
+    slots = [
+        {"slot_id": f"slot-{i}", "title": f"Task {i}", "start": "09:00", "end": "10:00", "category": "General"}
+        for i in range(n_slots)
+    ]
+    days = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+    return {"mode": "constant", "constant": slots, **{d: [] for d in days}}
+
+
+async def run(repeat: int) -> list:
+    rows = []
+    async with bench_app() as (http, counter):
+        for n in SLOT_COUNTS:
+            username = f"bench_today_{n}"
+            await http.post(f"/api/timetable/templates?username={username}", json=_template(n))
+            for i in range(0, n, 2):  # half the slots have a streak doc
+                await http.post(
+                    f"/api/timetable/mark-complete?username={username}",
+                    json={"task_id": f"slot-{i}", "date": "2024-01-01"},
+                )
+            # warm once so one-off index creation isn't counted
+            await http.get(f"/api/timetable/today?username={username}")
+            result = await measure(http, counter, "GET", f"/api/timetable/today?username={username}", repeat=repeat)
+            rows.append({"slots": n, **result})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--check", action="store_true", help="fail if round trips grow with slot count")
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args.repeat))
+    print(f"{'slots':>6} {'round trips':>12} {'mean ms':>9}")
+    for row in rows:
+        print(f"{row['slots']:>6} {row['round_trips']:>12.1f} {row['mean_ms']:>9.2f}")
+
+    if args.check and len({row["round_trips"] for row in rows}) != 1:
+        print("FAIL: round trips per request depend on slot count", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# benchmarks/harness.py
+# Runs the FastAPI app in-process against a local MongoDB stand-in and counts
+# database round trips per request.
+#
+# By default the stand-in is mongomock-motor (pip install mongomock-motor).
+# Set BENCH_MONGO_URI=mongodb://localhost:27017 to use a throwaway mongod instead;
+# round trips are then counted from pymongo command events.
+import contextvars
+import os
+import time
+from contextlib import asynccontextmanager
+
+os.environ.setdefault("MONGO_URI", os.getenv("BENCH_MONGO_URI", "mongodb://localhost:27017"))
+if not os.getenv("BENCH_MONGO_URI"):
+    os.environ.setdefault("NOTES_SEARCH_BACKEND", "memory")  # mongomock has no $text
+
+import httpx
+from pymongo import monitoring
+
+import database
+import indexes
+
+BENCH_MONGO_URI = os.getenv("BENCH_MONGO_URI")
+
+# Motor collection methods that each cost one round trip to the server
+_COUNTED_METHODS = [
+    "find", "find_one", "aggregate", "insert_one", "insert_many", "update_one", "update_many",
+    "replace_one", "delete_one", "delete_many", "find_one_and_update", "find_one_and_replace",
+    "find_one_and_delete", "count_documents", "bulk_write", "create_index",
+]
+
+
+# Label of the request the current task is issuing; commands are attributed to it.
+# Motor copies the context into its executor threads, so this also works for
+# command events from a real mongod.
+current_label = contextvars.ContextVar("bench_label", default=None)
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """Counts commands sent to MongoDB, grouped by command name and by request label."""
+
+    def __init__(self):
+        self.counts = {}
+        self.by_label = {}
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def reset(self):
+        self.counts = {}
+        self.by_label = {}
+
+    def record(self, name: str):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        label = current_label.get()
+        if label is not None:
+            self.by_label[label] = self.by_label.get(label, 0) + 1
+
+    # pymongo CommandListener interface (real mongod)
+    def started(self, event):
+        if event.command_name not in ("isMaster", "hello", "ping", "endSessions"):
+            self.record(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _patch_mock_collection(counter: RoundTripCounter):
+    """Wrap mongomock-motor collection methods so each call counts as one round trip."""
+    from mongomock_motor import AsyncMongoMockCollection
+
+    originals = {}
+    for name in _COUNTED_METHODS:
+        original = getattr(AsyncMongoMockCollection, name, None)
+        if original is None:
+            continue
+        originals[name] = original
+
+        def make_wrapper(name, original):
+            def wrapper(self, *args, **kwargs):
+                counter.record(name)
+                return original(self, *args, **kwargs)
+            return wrapper
+
+        setattr(AsyncMongoMockCollection, name, make_wrapper(name, original))
+    return originals
+
+
+def _unpatch_mock_collection(originals: dict):
+    from mongomock_motor import AsyncMongoMockCollection
+
+    for name, original in originals.items():
+        setattr(AsyncMongoMockCollection, name, original)
+
+
+@asynccontextmanager
+async def bench_app(app=None):
+    """
+    Yield (httpx client, RoundTripCounter) for the app backed by a fresh database.
+    The real-mongod databases are dropped afterwards.
+    """
+    counter = RoundTripCounter()
+    originals = {}
+    if BENCH_MONGO_URI:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(BENCH_MONGO_URI, event_listeners=[counter])
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+        originals = _patch_mock_collection(counter)
+
+    await database.connect(client=client)
+    if app is None:
+        from main import app
+    await indexes.create_declared()  # as the lifespan would; importing the app declared them
+    counter.reset()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            yield http, counter
+    finally:
+        if BENCH_MONGO_URI:
+            await client.drop_database(database.APP_DB_NAME)
+            await client.drop_database(database.AUTH_DB_NAME)
+        _unpatch_mock_collection(originals)
+        await database.close()
+
+
+async def measure(http, counter: RoundTripCounter, method: str, url: str, repeat: int = 20, **kwargs) -> dict:
+    """Issue the same request repeatedly; report mean latency and round trips per request."""
+    timings = []
+    counter.reset()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = await http.request(method, url, **kwargs)
+        timings.append(time.perf_counter() - start)
+        res.raise_for_status()
+    return {
+        "mean_ms": 1000 * sum(timings) / len(timings),
+        "round_trips": counter.total / repeat,
+        "commands": {k: v / repeat for k, v in counter.counts.items()},
+    }
@@ -0,0 +1,333 @@
+# benchmarks/suite.py
+# Load mixes for every router, run in-process (see harness.py for the Mongo
+# stand-in). Each scenario seeds its own users, then several virtual users
+# issue a weighted, seeded-random mix of requests concurrently. Reports
+# p50/p95/p99 latency, throughput and DB round trips per endpoint.
+#
+#   python -m benchmarks.suite [--scenario notes] [--users 8] [--requests 200]
+#   python -m benchmarks.suite --json results.json           # save for later
+#   python -m benchmarks.suite --compare results.json --check
+#
+# --check fails when any endpoint needs more round trips than in the baseline;
+# latency is printed as a delta but never fails the run, it is too noisy.
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.harness import BENCH_MONGO_URI, bench_app, current_label
+
+DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+# ================= Scenarios =================
+# A scenario is (setup, actions). setup(http, username, rng) returns per-user
+# state; each action is (weight, label, build, after) where build(state, rng)
+# returns httpx request kwargs and after(state, response), if given, updates
+# the state from the response.
+
+def _lorem(rng: random.Random, words: int) -> str:
+    vocab = ["plan", "meeting", "notes", "idea", "draft", "todo", "review", "call", "budget", "design"]
+    return " ".join(rng.choice(vocab) for _ in range(words))
+
+
+async def _setup_notes(http, username: str, rng: random.Random) -> dict:
+    ops = [{"title": f"Note {i}", "content": _lorem(rng, 80)} for i in range(200)]
+    res = await http.post(f"/api/notes/bulk?username={username}", json={"ops": ops})
+    ids = [r["id"] for r in res.json()["results"]]
+    return {"user": username, "ids": ids, "drafts": {}}
+
+
+def _autosave(state: dict, rng: random.Random) -> dict:
+    # Autosave keeps re-sending the same few notes with a growing body
+    note_id = rng.choice(state["ids"][:10])
+    draft = state["drafts"].get(note_id, "") + " " + _lorem(rng, 5)
+    state["drafts"][note_id] = draft
+    return {"method": "PUT", "url": f"/api/notes/{note_id}?username={state['user']}",
+            "json": {"title": "Draft", "content": draft}}
+
+
+def _note_created(state: dict, res):
+    if res.status_code == 200:
+        state["ids"].append(res.json()["id"])
+
+
+NOTES = (_setup_notes, [
+    (70, "PUT /api/notes/{id}", _autosave, None),
+    (12, "GET /api/notes?limit=50", lambda s, r: {"method": "GET", "url": f"/api/notes?username={s['user']}&limit=50"}, None),
+    (5, "GET /api/notes", lambda s, r: {"method": "GET", "url": f"/api/notes?username={s['user']}&fields=title"}, None),
+    (5, "POST /api/notes", lambda s, r: {"method": "POST", "url": f"/api/notes?username={s['user']}",
+                                         "json": {"title": "New", "content": _lorem(r, 20)}}, _note_created),
+    (5, "GET /api/notes/search", lambda s, r: {"method": "GET", "url": f"/api/notes/search?username={s['user']}&q={r.choice(['plan', 'budget', 'design'])}"}, None),
+    (3, "DELETE /api/notes/{id}", lambda s, r: {"method": "DELETE", "url": f"/api/notes/{s['ids'].pop()}?username={s['user']}"}, None),
+])
+
+
+async def _setup_todos(http, username: str, rng: random.Random) -> dict:
+    ops = [{"title": f"List {b}", "items": [
+        {"text": _lorem(rng, 4), "done": rng.random() < 0.3,
+         "reminderDate": "2099-01-01" if b % 2 == 0 and i % 7 == 0 else ""}  # half the lists use reminders
+        for i in range(30)
+    ]} for b in range(10)]
+    res = await http.post(f"/api/todos/bulk?username={username}", json={"ops": ops})
+    blocks = {}
+    for r in res.json()["results"]:
+        block = (await http.get(f"/api/todos/{r['id']}?username={username}")).json()
+        blocks[block["id"]] = block
+    return {"user": username, "blocks": blocks}
+
+
+def _toggle(state: dict, rng: random.Random) -> dict:
+    block = state["blocks"][rng.choice(list(state["blocks"]))]
+    item = rng.choice(block["items"])
+    item["done"] = not item["done"]
+    if BENCH_MONGO_URI:  # mongomock can't run the arrayFilters update behind PATCH
+        return {"method": "PATCH", "url": f"/api/todos/{block['id']}/items/{item['id']}?username={state['user']}",
+                "json": {"done": item["done"]}}
+    return {"method": "PUT", "url": f"/api/todos/{block['id']}?username={state['user']}",
+            "json": {"title": block["title"], "items": block["items"]}}
+
+
+def _add_item(state: dict, rng: random.Random) -> dict:
+    block_id = rng.choice(list(state["blocks"]))
+    return {"method": "POST", "url": f"/api/todos/{block_id}/items?username={state['user']}",
+            "json": {"text": _lorem(rng, 3)}}
+
+
+def _item_added(state: dict, res):
+    if res.status_code == 200:
+        state["blocks"][res.request.url.path.split("/")[3]]["items"].append(res.json())
+
+
+TOGGLE_LABEL = "PATCH /api/todos/{id}/items/{item}" if BENCH_MONGO_URI else "PUT /api/todos/{id} (toggle)"
+
+TODOS = (_setup_todos, [
+    (60, TOGGLE_LABEL, _toggle, None),
+    (15, "GET /api/todos/{id}", lambda s, r: {"method": "GET", "url": f"/api/todos/{r.choice(list(s['blocks']))}?username={s['user']}"}, None),
+    (10, "GET /api/todos", lambda s, r: {"method": "GET", "url": f"/api/todos?username={s['user']}"}, None),
+    (10, "POST /api/todos/{id}/items", _add_item, _item_added),
+    (5, "GET /api/todos/reminders/upcoming", lambda s, r: {"method": "GET", "url": f"/api/todos/reminders/upcoming?username={s['user']}&hours=744"}, None),
+])
+
+
+async def _setup_timetable(http, username: str, rng: random.Random) -> dict:
+    slots = [{"slot_id": f"slot-{i}", "title": f"Task {i}", "start": f"{8 + i}:00", "end": f"{9 + i}:00"} for i in range(10)]
+    template = {"mode": "constant", "constant": slots, **{d: [] for d in DAYS}}
+    await http.post(f"/api/timetable/templates?username={username}", json=template)
+    return {"user": username, "slots": [s["slot_id"] for s in slots], "etag": None}
+
+
+def _templates_etag(state: dict, res):
+    state["etag"] = res.headers.get("etag") or state["etag"]
+
+
+def _get_templates(state: dict, rng: random.Random) -> dict:
+    headers = {"If-None-Match": state["etag"]} if state["etag"] and rng.random() < 0.5 else {}
+    return {"method": "GET", "url": f"/api/timetable/templates?username={state['user']}", "headers": headers}
+
+
+def _mark_complete(state: dict, rng: random.Random) -> dict:
+    return {"method": "POST", "url": f"/api/timetable/mark-complete?username={state['user']}",
+            "json": {"task_id": rng.choice(state["slots"]), "date": datetime.now().strftime("%Y-%m-%d")}}
+
+
+TIMETABLE = (_setup_timetable, [
+    (70, "GET /api/timetable/today", lambda s, r: {"method": "GET", "url": f"/api/timetable/today?username={s['user']}"}, None),
+    (15, "GET /api/timetable/templates", _get_templates, _templates_etag),
+    (15, "POST /api/timetable/mark-complete", _mark_complete, None),
+])
+
+
+async def _setup_auth(http, username: str, rng: random.Random) -> dict:
+    from authent import get_users_collection
+    email = f"{username}@example.com"
+    await get_users_collection().insert_one(
+        {"name": username, "email": email, "phoneNumber": "0", "password": "bench-password", "otp": None, "otpExpires": None}
+    )
+    res = await http.post("/api/login", json={"email": email, "password": "bench-password"})
+    return {"email": email, "token": res.json()["token"]}
+
+
+AUTH = (_setup_auth, [
+    (80, "GET /api/protected", lambda s, r: {"method": "GET", "url": "/api/protected",
+                                             "headers": {"Authorization": f"Bearer {s['token']}"}}, None),
+    (20, "POST /api/login", lambda s, r: {"method": "POST", "url": "/api/login",
+                                          "json": {"email": s["email"], "password": "bench-password"}}, None),
+])
+
+
+async def _setup_sync(http, username: str, rng: random.Random) -> dict:
+    state = await _setup_notes(http, username, rng)
+    state["since"] = 0
+    return state
+
+
+def _sync_version(state: dict, res):
+    if res.status_code == 200:
+        state["since"] = res.json()["version"]
+
+
+SYNC = (_setup_sync, [
+    (50, "GET /api/sync", lambda s, r: {"method": "GET", "url": f"/api/sync?username={s['user']}&since={s['since']}"}, _sync_version),
+    (50, "PUT /api/notes/{id}", _autosave, None),
+])
+
+SCENARIOS = {"notes": NOTES, "todos": TODOS, "timetable": TIMETABLE, "auth": AUTH, "sync": SYNC}
+
+
+# ================= Runner =================
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+async def _user_loop(http, actions: list, state: dict, rng: random.Random, n: int, samples: dict):
+    weights = [a[0] for a in actions]
+    for _ in range(n):
+        _, label, build, after = rng.choices(actions, weights)[0]
+        kwargs = build(state, rng)
+        token = current_label.set(label)
+        try:
+            start = time.perf_counter()
+            res = await http.request(**kwargs)
+            elapsed = time.perf_counter() - start
+        finally:
+            current_label.reset(token)
+        entry = samples.setdefault(label, {"latencies": [], "errors": 0})
+        entry["latencies"].append(elapsed)
+        if res.status_code >= 400:
+            entry["errors"] += 1
+        if after is not None:
+            after(state, res)
+
+
+async def run_scenario(http, counter, name: str, users: int, requests: int, seed: int) -> dict:
+    setup, actions = SCENARIOS[name]
+    rngs = [random.Random(f"{seed}:{name}:{u}") for u in range(users)]
+    states = [await setup(http, f"bench_{name}_{u}", rngs[u]) for u in range(users)]
+
+    # One pass over every action so one-off index creation isn't measured
+    for state, rng in zip(states, rngs):
+        for _, label, build, after in actions:
+            res = await http.request(**build(state, rng))
+            if after is not None:
+                after(state, res)
+
+    counter.reset()
+    samples = {}
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _user_loop(http, actions, states[u], rngs[u], requests, samples) for u in range(users)
+    ])
+    wall = time.perf_counter() - start
+
+    endpoints = {}
+    for label, entry in sorted(samples.items()):
+        lat = sorted(entry["latencies"])
+        endpoints[label] = {
+            "count": len(lat),
+            "errors": entry["errors"],
+            "p50_ms": round(1000 * percentile(lat, 50), 3),
+            "p95_ms": round(1000 * percentile(lat, 95), 3),
+            "p99_ms": round(1000 * percentile(lat, 99), 3),
+            "mean_ms": round(1000 * sum(lat) / len(lat), 3),
+            "rps": round(len(lat) / wall, 1),
+            "round_trips": round(counter.by_label.get(label, 0) / len(lat), 2),
+        }
+    total = sum(e["count"] for e in endpoints.values())
+    return {"wall_s": round(wall, 3), "requests": total, "rps": round(total / wall, 1), "endpoints": endpoints}
+
+
+async def run_all(names: list, users: int, requests: int, seed: int) -> dict:
+    # Scenarios share one app and database; their usernames don't overlap
+    async with bench_app() as (http, counter):
+        return {name: await run_scenario(http, counter, name, users, requests, seed) for name in names}
+
+
+def _git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def print_report(report: dict, baseline: dict | None):
+    for name, scenario in report["scenarios"].items():
+        print(f"\n== {name}: {scenario['requests']} requests in {scenario['wall_s']:.2f}s ({scenario['rps']} req/s)")
+        print(f"{'endpoint':<40} {'n':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>7} {'trips':>6}  vs baseline")
+        base = (baseline or {}).get("scenarios", {}).get(name, {}).get("endpoints", {})
+        for label, e in scenario["endpoints"].items():
+            delta = ""
+            if label in base:
+                b = base[label]
+                dp = (e["p95_ms"] / b["p95_ms"] - 1) * 100 if b["p95_ms"] else 0.0
+                delta = f"p95 {dp:+.0f}%, trips {e['round_trips'] - b['round_trips']:+.2f}"
+            errors = f" ({e['errors']} errors)" if e["errors"] else ""
+            print(f"{label:<40} {e['count']:>5} {e['p50_ms']:>8.2f} {e['p95_ms']:>8.2f} {e['p99_ms']:>8.2f} "
+                  f"{e['rps']:>7.1f} {e['round_trips']:>6.2f}  {delta}{errors}")
+
+
+def round_trip_regressions(report: dict, baseline: dict) -> list:
+    found = []
+    for name, scenario in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name, {}).get("endpoints", {})
+        for label, e in scenario["endpoints"].items():
+            if label in base and e["round_trips"] > base[label]["round_trips"] + 0.05:
+                found.append(f"{name} / {label}: {base[label]['round_trips']} -> {e['round_trips']} round trips")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NoteKit load mixes")
+    parser.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    parser.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--requests", type=int, default=100, help="requests per user")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON from an earlier run")
+    parser.add_argument("--check", action="store_true", help="with --compare: fail if round trips went up")
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    report = {
+        "meta": {
+            **_git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "backend": "mongod" if BENCH_MONGO_URI else "mongomock",
+            "python": platform.python_version(),
+            "users": args.users, "requests_per_user": args.requests, "seed": args.seed,
+        },
+        "scenarios": asyncio.run(run_all(names, args.users, args.requests, args.seed)),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("backend") != report["meta"]["backend"]:
+            print("warning: baseline was recorded against a different backend", file=sys.stderr)
+
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.check and baseline:
+        regressions = round_trip_regressions(report, baseline)
+        for line in regressions:
+            print(f"FAIL: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bulk.py
+# Shared plumbing for the /bulk endpoints: a mixed batch of upserts and deletes
+# is checked up front, sent as one unordered bulk_write, and the outcome mapped
+# back onto one result per operation (in request order).
+import os
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+
+BULK_MAX_OPS = int(os.getenv("BULK_MAX_OPS", "1000"))
+
+
+def result(index: int, id, status: str, error: str | None = None) -> dict:
+    out = {"index": index, "id": str(id) if id is not None else None, "status": status}
+    if error is not None:
+        out["error"] = error
+    return out
+
+
+def resolve_ids(ops: list) -> tuple[list, dict]:
+    """
+    ObjectId per operation (fresh ones for upserts without an id), plus error
+    results for operations that can't run: bad or missing ids, and repeats of
+    an id already used earlier in the batch (unordered writes have no defined
+    order between them).
+    """
+    if len(ops) > BULK_MAX_OPS:
+        raise HTTPException(status_code=400, detail=f"Too many operations (max {BULK_MAX_OPS})")
+    ids, errors, seen = [], {}, set()
+    for index, op in enumerate(ops):
+        oid = None
+        if op.id is None:
+            if op.op == "delete":
+                errors[index] = result(index, None, "error", "id is required for delete")
+            else:
+                oid = ObjectId()
+        else:
+            try:
+                oid = ObjectId(op.id)
+            except (InvalidId, TypeError):
+                errors[index] = result(index, op.id, "error", "Invalid id")
+        if oid is not None and oid in seen:
+            errors[index] = result(index, oid, "error", "Duplicate id in batch")
+        elif oid is not None:
+            seen.add(oid)
+        ids.append(oid)
+    return ids, errors
+
+
+async def existing_ids(coll, ids: list) -> set:
+    """Which of these _ids exist for the owner (one $in query; none if ids is empty)."""
+    if not ids:
+        return set()
+    return {doc["_id"] async for doc in coll.find({"_id": {"$in": ids}}, {"_id": 1})}
+
+
+async def execute(coll, requests: dict) -> tuple[set, dict]:
+    """
+    Run {op index: pymongo request} as one unordered bulk_write.
+    Returns (indexes that were upserted as new documents, {index: error message}).
+    """
+    if not requests:
+        return set(), {}
+    order = list(requests)
+    try:
+        details = (await coll.bulk_write([requests[i] for i in order], ordered=False)).bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+    upserted = {order[u["index"]] for u in details.get("upserted", [])}
+    errors = {order[e["index"]]: e.get("errmsg", "Write failed") for e in details.get("writeErrors", [])}
+    return upserted, errors
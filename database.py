@@ -0,0 +1,78 @@
+# database.py
+import asyncio
+import os
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from motor.motor_asyncio import AsyncIOMotorClient
+import metrics
+
+MONGO_URI = os.getenv("MONGO_URI")
+
+# Pool tuning (all optional, sensible defaults for a single API worker)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")  # e.g. "zstd,snappy,zlib"; empty disables
+
+AUTH_DB_NAME = "test"      # users live here
+APP_DB_NAME = "NOTEkiT"    # notes, todos, timetable
+
+_client: AsyncIOMotorClient | None = None
+
+
+def _build_client() -> AsyncIOMotorClient:
+    if not MONGO_URI:
+        raise RuntimeError("MONGO_URI not set in environment")
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    listeners = metrics.mongo_listeners()  # command + pool monitoring for /metrics
+    if listeners:
+        options["event_listeners"] = listeners
+    return AsyncIOMotorClient(MONGO_URI, **options)
+
+
+def get_client() -> AsyncIOMotorClient:
+    """Return the process-wide client, creating it lazily if the lifespan hasn't run."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+def get_auth_db():
+    return get_client()[AUTH_DB_NAME]
+
+
+def get_app_db():
+    return get_client()[APP_DB_NAME]
+
+
+async def connect(client: AsyncIOMotorClient | None = None):
+    """
+    Open the shared client and warm up the pool before the app reports ready.
+    A pre-built client (e.g. a mock) can be passed in; it is used as-is.
+    """
+    global _client
+    if client is not None:
+        _client = client
+        return _client
+
+    _client = _build_client()
+    # One ping per min-pool connection so the first requests don't pay the handshakes.
+    warmup = max(MONGO_MIN_POOL_SIZE, 1)
+    db = _client[AUTH_DB_NAME]
+    await asyncio.gather(*(db.command("ping") for _ in range(warmup)))
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
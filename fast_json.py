@@ -0,0 +1,29 @@
+# fast_json.py
+# orjson-backed JSON responses, plus a way for routers to skip FastAPI's
+# response_model revalidation when their serializers already build the exact
+# output shape.
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib encoder
+    orjson = None
+
+
+if orjson is not None:
+    class FastJSONResponse(JSONResponse):
+        def render(self, content) -> bytes:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+else:
+    FastJSONResponse = JSONResponse
+
+
+def render(payload, trusted: bool, headers: dict | None = None):
+    """
+    With trusted=True, encode the payload right away and return a Response,
+    which FastAPI passes through without validating it against response_model
+    or running jsonable_encoder. Otherwise return the payload untouched.
+    """
+    if trusted:
+        return FastJSONResponse(payload, headers=headers)
+    return payload
@@ -0,0 +1,47 @@
+# http_client.py
+# One pooled outbound HTTP client per worker, opened and closed by the app lifespan.
+import importlib.util
+import os
+import httpx
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1" and importlib.util.find_spec("h2") is not None
+
+_client: httpx.AsyncClient | None = None
+
+
+def _build_client(transport: httpx.AsyncBaseTransport | None = None) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED and transport is None,
+        timeout=HTTP_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        transport=transport,
+    )
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it lazily if the lifespan hasn't run."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+async def start(transport: httpx.AsyncBaseTransport | None = None):
+    """Open the shared client. Pass an httpx.MockTransport to run without the network."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = _build_client(transport)
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
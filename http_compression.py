@@ -0,0 +1,172 @@
+# http_compression.py
+# gzip / brotli response compression as pure ASGI middleware.
+#
+# Only responses whose Content-Type is on COMPRESSION_TYPES are touched, and
+# complete bodies under COMPRESSION_MIN_BYTES go out as they are (the headers
+# would eat the saving). Streamed responses (NDJSON lists) are compressed
+# chunk by chunk and flushed after each one, so clients still see every batch
+# as soon as it is sent. Responses that already carry a Content-Encoding,
+# partial content (206) and byte-range resources are passed through.
+#
+# COMPRESSION_ENCODINGS is the server's preference among what the client
+# accepts. gzip comes first by default: on note-list JSON at on-the-fly
+# settings it came out smaller and faster than brotli (see
+# benchmarks/bench_compression.py; re-run it on real payloads before
+# changing). brotli needs the optional brotli package (pip install brotli).
+import os
+import zlib
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") == "1"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_TYPES = tuple(t.strip() for t in os.getenv(
+    "COMPRESSION_TYPES", "application/json,application/x-ndjson,text/").split(",") if t.strip())
+COMPRESSION_ENCODINGS = [e.strip() for e in os.getenv("COMPRESSION_ENCODINGS", "gzip,br").split(",")
+                         if e.strip() == "gzip" or (e.strip() == "br" and brotli is not None)]
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+_SKIP_STATUSES = {204, 206, 304}
+
+
+def _accepted(header: str) -> set:
+    """Codings the client accepts (q > 0)."""
+    accepted = set()
+    for item in header.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.strip())
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    accepted = _accepted(accept_encoding)
+    for encoding in COMPRESSION_ENCODINGS:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+class _Encoder:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._gz = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress and flush, so the client can decode everything sent so far."""
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.flush()
+        return self._gz.compress(data) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.finish()
+        return self._gz.compress(data) + self._gz.flush()
+
+
+def _compressible(headers: list, status: int) -> bool:
+    if status < 200 or status in _SKIP_STATUSES:
+        return False
+    content_type = b""
+    for name, value in headers:
+        if name in (b"content-encoding", b"content-range", b"accept-ranges"):
+            return False
+        if name == b"content-type":
+            content_type = value
+    return content_type.decode("latin-1").startswith(COMPRESSION_TYPES)
+
+
+def _with_encoding(headers: list, encoding: str, length: int | None) -> list:
+    out = []
+    for name, value in headers:
+        if name == b"content-length":
+            continue
+        if name == b"etag" and not value.startswith(b"W/"):
+            value = b"W/" + value  # the compressed bytes differ from the identity ones
+        out.append((name, value))
+    out.append((b"content-encoding", encoding.encode()))
+    if length is not None:
+        out.append((b"content-length", str(length).encode()))
+    return out
+
+
+def _add_vary(headers: list) -> list:
+    for i, (name, value) in enumerate(headers):
+        if name == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (name, value + b", Accept-Encoding")
+            return headers
+    headers.append((b"vary", b"Accept-Encoding"))
+    return headers
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        accept = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept-encoding"), "")
+        encoding = choose_encoding(accept)
+
+        start = None      # held http.response.start until the first body chunk decides
+        encoder = None    # set once we are compressing
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, encoder, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if not _compressible(headers, message["status"]):
+                    passthrough = True
+                    await send(message)
+                    return
+                start = {**message, "headers": _add_vary(headers)}
+                if encoding is None:  # identity, but caches must still key on Accept-Encoding
+                    passthrough = True
+                    await send(start)
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if encoder is None:
+                if not more:
+                    # Whole body in one message: compress only if it is worth it
+                    if len(body) < self.minimum_size:
+                        passthrough = True
+                        await send(start)
+                        await send(message)
+                        return
+                    compressed = _Encoder(encoding).finish(body)
+                    await send({**start, "headers": _with_encoding(start["headers"], encoding, len(compressed))})
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                encoder = _Encoder(encoding)
+                await send({**start, "headers": _with_encoding(start["headers"], encoding, None)})
+            data = encoder.chunk(body) if more else encoder.finish(body)
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
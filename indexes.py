@@ -0,0 +1,49 @@
+# indexes.py
+# Index declarations for the fixed collections, built at startup.
+#
+# Modules declare the indexes their queries need next to the code that runs
+# those queries; create_declared() builds them all concurrently before the app
+# reports ready. create_index returns straight away for an index that already
+# exists with the same spec, so every pod can run it on every start.
+# Per-user collections come and go with their users and keep getting their
+# indexes lazily, once per process (storage.ensure_index).
+import asyncio
+import logging
+import time
+from pymongo.errors import OperationFailure
+from database import get_app_db, get_auth_db
+
+logger = logging.getLogger(__name__)
+
+_DATABASES = {"auth": get_auth_db, "app": get_app_db}
+
+# (database, collection, keys, options)
+DECLARED = []
+
+
+def declare(database: str, collection: str, keys, **options):
+    if database not in _DATABASES:
+        raise ValueError(f"Unknown database {database!r}")
+    DECLARED.append((database, collection, keys, options))
+
+
+async def _create(database: str, collection: str, keys, options: dict) -> bool:
+    try:
+        await _DATABASES[database]()[collection].create_index(keys, **options)
+        return True
+    except OperationFailure as e:
+        # e.g. duplicates blocking a unique index, or a same-named index with other
+        # options. Serve anyway (as before); the log says what to clean up.
+        logger.warning("index %s on %s.%s not created: %s", keys, database, collection, e)
+        return False
+
+
+async def create_declared() -> dict:
+    """Build every declared index; returns a summary for the startup report."""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_create(*spec) for spec in DECLARED))
+    return {
+        "declared": len(DECLARED),
+        "failed": results.count(False),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
@@ -0,0 +1,107 @@
+# listing.py
+# Shared helpers for list endpoints: keyset cursors over _id, field projection
+# and NDJSON streaming.
+import base64
+import binascii
+import json
+import os
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+
+MAX_PAGE_SIZE = 200
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "200"))
+
+
+def encode_cursor(oid: ObjectId) -> str:
+    """Opaque, URL-safe token for the last _id on a page."""
+    return base64.urlsafe_b64encode(oid.binary).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> ObjectId:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        return ObjectId(raw)
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: str | None, allowed: set) -> list | None:
+    """Parse ?fields=title,content into a list of allowed field names (None = everything)."""
+    if not fields:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip() and f.strip() != "id"]
+    unknown = [f for f in names if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def projection_for(fields: list | None, stored: dict | None = None) -> dict | None:
+    """Projection for the requested fields; stored maps a field to the stored fields it is built from."""
+    if fields is None:
+        return None
+    stored = stored or {}
+    return {name: 1 for f in fields for name in stored.get(f, (f,))}  # _id always comes back
+
+
+def pick_fields(item: dict, fields: list | None) -> dict:
+    """Trim a serialized item down to id + the requested fields."""
+    if fields is None:
+        return item
+    return {k: v for k, v in item.items() if k == "id" or k in fields}
+
+
+def _after_query(after: str | None) -> dict:
+    if after:
+        return {"_id": {"$gt": decode_cursor(after)}}
+    return {}
+
+
+async def fetch_page(coll, serializer, limit: int, after: str | None = None, fields: list | None = None,
+                     stored: dict | None = None) -> dict:
+    """
+    One page of documents in _id order, starting after the given cursor.
+    Reads limit + 1 documents to know whether another page exists.
+    """
+    cursor = coll.find(_after_query(after), projection_for(fields, stored)).sort([("_id", 1)]).limit(limit + 1)
+    docs = await cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]["_id"])
+    return {
+        "items": [pick_fields(serializer(doc), fields) for doc in docs],
+        "next_cursor": next_cursor,
+    }
+
+
+# ================= NDJSON streaming =================
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def stream_ndjson(coll, serializer, after: str | None = None, fields: list | None = None,
+                  batch_size: int = STREAM_BATCH_SIZE, stored: dict | None = None) -> StreamingResponse:
+    """
+    Stream every matching document as one JSON object per line, in _id order.
+    Documents are pulled from Mongo and flushed to the client batch_size at a
+    time, so memory per request is bounded by the batch, not the user's data.
+    """
+    cursor = coll.find(_after_query(after), projection_for(fields, stored)).sort([("_id", 1)]).batch_size(batch_size)
+
+    async def body():
+        lines = []
+        async for doc in cursor:
+            lines.append(json.dumps(pick_fields(serializer(doc), fields), separators=(",", ":")))
+            if len(lines) >= batch_size:
+                yield ("\n".join(lines) + "\n").encode()
+                lines = []
+        if lines:
+            yield ("\n".join(lines) + "\n").encode()
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,315 @@
+# mailer.py
+# Email outbox: routes enqueue messages and return immediately; one background
+# worker drains the queue over a single authenticated SMTP connection that is
+# reused across sends. Blocking smtplib calls run in a thread, never on the loop.
+#
+# For local testing point it at a plain SMTP stand-in, e.g.
+#   python -m aiosmtpd -n -l localhost:8025
+#   SMTP_HOST=localhost SMTP_PORT=8025 SMTP_SSL=0 EMAIL_USER= ...
+import asyncio
+import logging
+import os
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from database import get_auth_db
+import indexes
+
+logger = logging.getLogger(__name__)
+
+EMAIL_USER = os.getenv("EMAIL_USER")
+EMAIL_PASS = os.getenv("EMAIL_PASS")
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "1") == "1"
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "5"))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_RETRY_BASE_SECONDS", "2"))
+EMAIL_IDLE_CLOSE_SECONDS = float(os.getenv("EMAIL_IDLE_CLOSE_SECONDS", "60"))
+EMAIL_OUTBOX_PERSIST = os.getenv("EMAIL_OUTBOX_PERSIST", "0") == "1"
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "600"))
+EMAIL_RECLAIM_INTERVAL_SECONDS = float(os.getenv("EMAIL_RECLAIM_INTERVAL_SECONDS", "60"))
+OUTBOX_COLLECTION = "email_outbox"
+if EMAIL_OUTBOX_PERSIST:
+    indexes.declare("auth", OUTBOX_COLLECTION, [("status", 1), ("lease_until", 1)])  # reclaim query
+
+
+class EmailOutbox:
+    """
+    asyncio queue + single worker. With a persist collection, each message is
+    stored before it is queued and deleted once sent. A graceful stop releases
+    the leases on unsent messages; messages left behind by a crashed worker are
+    re-claimed once their lease expires, at start and every reclaim_interval.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, use_ssl=SMTP_SSL, username=EMAIL_USER,
+                 password=EMAIL_PASS, sender=EMAIL_USER, persist_collection=None,
+                 batch_size=EMAIL_BATCH_SIZE, max_retries=EMAIL_MAX_RETRIES,
+                 retry_base=EMAIL_RETRY_BASE_SECONDS, idle_close=EMAIL_IDLE_CLOSE_SECONDS,
+                 reclaim_interval=EMAIL_RECLAIM_INTERVAL_SECONDS):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.persist_collection = persist_collection
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.idle_close = idle_close
+        self.reclaim_interval = reclaim_interval
+
+        self._queue = None
+        self._worker = None
+        self._retries = set()
+        self._leased = set()  # _ids of persisted messages this worker holds, queued or retrying
+        self._unforgotten = []  # _ids of sent messages whose delete failed; retried
+        self._smtp = None  # only touched from the worker's thread calls
+        self.sent = 0
+        self.failed = 0
+
+    # ---------- lifecycle ----------
+    async def start(self):
+        if self._worker is not None and not self._worker.done():
+            return
+        if self._worker is not None and not self._worker.cancelled() and self._worker.exception():
+            logger.error("email outbox worker died, restarting", exc_info=self._worker.exception())
+        if self._queue is None:  # a restarted worker keeps the messages already queued
+            self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+        if self.persist_collection is not None:
+            await self._reclaim_pending()
+
+    async def stop(self, timeout: float = 10.0):
+        """Give queued mail a chance to go out, then close the SMTP connection."""
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("email outbox stopped with %d messages queued", self._queue.qsize())
+        for task in list(self._retries):
+            task.cancel()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        self._queue = None
+        await self._forget([])  # sent messages whose delete failed earlier
+        await self._release_leases()
+        await asyncio.to_thread(self._disconnect)
+
+    async def enqueue(self, to_email: str, subject: str, body: str):
+        await self.start()
+        item = {"to": to_email, "subject": subject, "body": body, "attempts": 0}
+        if self.persist_collection is not None:
+            lease_until = datetime.utcnow() + timedelta(seconds=EMAIL_OUTBOX_LEASE_SECONDS)
+            result = await self.persist_collection.insert_one(
+                {**item, "status": "queued", "lease_until": lease_until, "created_at": datetime.utcnow()}
+            )
+            item["_id"] = result.inserted_id
+            self._leased.add(item["_id"])
+        self._queue.put_nowait(item)
+
+    # ---------- worker ----------
+    async def _run(self):
+        persist = self.persist_collection is not None
+        wait = min(self.idle_close, self.reclaim_interval) if persist else self.idle_close
+        last_batch = time.monotonic()
+        next_reclaim = last_batch + self.reclaim_interval  # start() has just reclaimed
+        while True:
+            if persist and time.monotonic() >= next_reclaim:
+                next_reclaim = time.monotonic() + self.reclaim_interval
+                try:
+                    await self._reclaim_pending()
+                except Exception as e:
+                    logger.warning("email outbox reclaim failed: %s", e)
+            try:
+                first = await asyncio.wait_for(self._queue.get(), wait)
+            except asyncio.TimeoutError:
+                await self._forget([])
+                if time.monotonic() - last_batch >= self.idle_close:
+                    await asyncio.to_thread(self._disconnect)  # don't hold an idle connection open
+                continue
+            last_batch = time.monotonic()
+
+            batch = [first]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                failures = await asyncio.to_thread(self._send_batch, batch)
+            except Exception as e:  # connect/login failed: the whole batch is retried
+                logger.warning("SMTP connection failed: %s", e)
+                failures = [(item, e) for item in batch]
+
+            # Bookkeeping writes below must not kill the worker: a Mongo error
+            # here is logged and the loop (and its queue) carries on.
+            failed_ids = {id(item) for item, _ in failures}
+            sent = [item for item in batch if id(item) not in failed_ids]
+            self.sent += len(sent)
+            await self._forget(sent)
+            for item, error in failures:
+                try:
+                    await self._schedule_retry(item, error)
+                except Exception as e:
+                    logger.warning("could not record failed email to %s: %s", item["to"], e)
+
+            for _ in batch:
+                self._queue.task_done()
+
+    def _send_batch(self, batch: list) -> list:
+        """
+        Runs in a thread. Returns [(item, error)] for messages that didn't go
+        out; anything not in that list was delivered and must not be resent.
+        """
+        self._ensure_connected()
+        failures = []
+        for i, item in enumerate(batch):
+            msg = self._build_message(item)
+            try:
+                self._smtp.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # Server dropped the connection; reconnect once and resend.
+                try:
+                    self._disconnect()
+                    self._ensure_connected()
+                except Exception as e:  # can't reconnect: this and the rest of the batch are unsent
+                    return failures + [(rest, e) for rest in batch[i:]]
+                try:
+                    self._smtp.send_message(msg)
+                except Exception as e:
+                    failures.append((item, e))
+            except Exception as e:
+                failures.append((item, e))
+        return failures
+
+    def _build_message(self, item: dict) -> EmailMessage:
+        msg = EmailMessage()
+        msg["Subject"] = item["subject"]
+        msg["From"] = self.sender
+        msg["To"] = item["to"]
+        msg.set_content(item["body"])
+        return msg
+
+    def _ensure_connected(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return
+            except smtplib.SMTPException:
+                pass
+            self._disconnect()
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT_SECONDS)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT_SECONDS)
+        if self.username:
+            smtp.login(self.username, self.password)
+        self._smtp = smtp
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+    async def _schedule_retry(self, item: dict, error: Exception):
+        item["attempts"] += 1
+        if item["attempts"] > self.max_retries:
+            self.failed += 1
+            logger.error("giving up on email to %s after %d attempts: %s", item["to"], item["attempts"], error)
+            if self.persist_collection is not None and "_id" in item:
+                self._leased.discard(item["_id"])
+                await self.persist_collection.update_one(
+                    {"_id": item["_id"]}, {"$set": {"status": "failed", "error": str(error)}}
+                )
+            return
+
+        delay = self.retry_base * (2 ** (item["attempts"] - 1))
+
+        async def requeue():
+            await asyncio.sleep(delay)
+            self._queue.put_nowait(item)
+
+        task = asyncio.create_task(requeue())
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    # ---------- persistence ----------
+    async def _forget(self, items: list):
+        """Delete sent messages; if that fails they are kept (and still leased) and retried next time."""
+        if self.persist_collection is None:
+            return
+        self._unforgotten += [item["_id"] for item in items if "_id" in item]
+        if not self._unforgotten:
+            return
+        try:
+            await self.persist_collection.delete_many({"_id": {"$in": self._unforgotten}})
+        except Exception as e:
+            logger.warning("could not delete %d sent emails from the outbox: %s", len(self._unforgotten), e)
+            return
+        self._leased.difference_update(self._unforgotten)
+        self._unforgotten = []
+
+    async def _reclaim_pending(self):
+        """Queue messages whose previous owner died (or stopped) before sending them."""
+        while True:
+            now = datetime.utcnow()
+            doc = await self.persist_collection.find_one_and_update(
+                {"status": "queued", "lease_until": {"$lte": now}},  # released leases hold "now" (ms precision)
+                {"$set": {"lease_until": now + timedelta(seconds=EMAIL_OUTBOX_LEASE_SECONDS)}},
+            )
+            if doc is None:
+                return
+            if doc["_id"] in self._leased:
+                continue  # still ours, just slow (long queue or retries); the lease is renewed
+            self._leased.add(doc["_id"])
+            self._queue.put_nowait({
+                "_id": doc["_id"], "to": doc["to"], "subject": doc["subject"],
+                "body": doc["body"], "attempts": doc.get("attempts", 0),
+            })
+
+    async def _release_leases(self):
+        """On shutdown: let the next worker to start take over unsent messages right away."""
+        if self.persist_collection is None or not self._leased:
+            return
+        try:
+            await self.persist_collection.update_many(
+                {"_id": {"$in": list(self._leased)}, "status": "queued"},
+                {"$set": {"lease_until": datetime.utcnow()}},
+            )
+        except Exception as e:
+            logger.warning("email outbox could not release %d leases: %s", len(self._leased), e)
+        self._leased.clear()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "retrying": len(self._retries),
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+outbox = EmailOutbox()
+
+
+async def start_outbox():
+    if EMAIL_OUTBOX_PERSIST:
+        outbox.persist_collection = get_auth_db()[OUTBOX_COLLECTION]
+    await outbox.start()
+
+
+async def stop_outbox():
+    await outbox.stop()
@@ -1,29 +1,88 @@
+# main.py
+# App factory. Importing the routers only reads settings; clients are opened
+# and indexes built by the lifespan, before the worker accepts traffic.
+#   uvicorn main:app                     (module-level instance)
+#   uvicorn --factory main:create_app    (fresh app per call)
+import settings  # noqa: F401
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import database
+import indexes
+import mailer
+import http_client
+import http_compression
+import reminders
+import metrics
+from fast_json import FastJSONResponse
 from authent import router as auth_router
 from notes import router as notes_router
 from auth_google import router as google_router
 from todos import router as todos_router
 from timetable import router as timetable_router
+from sync import router as sync_router
 
-app = FastAPI(title="NoteKit API ", description="Combined Auth & Notes API", version="1.0.0")
+logger = logging.getLogger("notekit")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-# ✅ Include routers
-app.include_router(auth_router)
-app.include_router(notes_router)
-app.include_router(google_router)
-app.include_router(todos_router)
-app.include_router(timetable_router)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # One shared Mongo pool per worker, warmed up before we accept traffic
+    await database.connect()
+    # Independent of each other, so they overlap
+    index_report, _, _ = await asyncio.gather(
+        indexes.create_declared(), mailer.start_outbox(), http_client.start())
+    await reminders.start_scheduler()
+    ready = time.perf_counter() - started
+    app.state.startup = {"ready_seconds": round(ready, 3), "indexes": index_report}
+    metrics.STARTUP_SECONDS.set(ready)
+    logger.info("ready in %.0f ms (%d indexes in %.0f ms, %d failed)", ready * 1000,
+                index_report["declared"], index_report["seconds"] * 1000, index_report["failed"])
+    yield
+    await reminders.stop_scheduler()
+    await http_client.close()
+    await mailer.stop_outbox()
+    await database.close()
+
 
-@app.get("/")
 async def root():
     return {"message": "Welcome to Kalki API — Auth + Notes combined!"}
 
+
+async def prometheus_metrics():
+    return metrics.metrics_response()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="NoteKit API ", description="Combined Auth & Notes API", version="1.0.0",
+                  lifespan=lifespan, default_response_class=FastJSONResponse)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["ETag"],
+    )
+    app.add_middleware(http_compression.CompressionMiddleware)
+    app.add_middleware(metrics.MetricsMiddleware)  # outermost, so it times everything below
+
+    # ✅ Include routers
+    app.include_router(auth_router)
+    app.include_router(notes_router)
+    app.include_router(google_router)
+    app.include_router(todos_router)
+    app.include_router(timetable_router)
+    app.include_router(sync_router)
+
+    app.get("/")(root)
+    app.get("/metrics", include_in_schema=False)(prometheus_metrics)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,206 @@
+# metrics.py
+# Prometheus metrics: per-route HTTP latency/status, in-flight requests, and
+# MongoDB command and connection-pool stats from pymongo's monitoring hooks.
+# Every HTTP request also records how many Mongo commands it issued, so N+1
+# query patterns show up as a high db_commands count for that route.
+#
+# With several worker processes, set PROMETHEUS_MULTIPROC_DIR to a shared,
+# empty directory so /metrics aggregates all of them.
+import contextvars
+import os
+import time
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from pymongo import monitoring
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+DB_COMMANDS_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+UNMATCHED_ROUTE = "<unmatched>"  # 404s etc.; keeps raw paths out of the labels
+
+# ================= HTTP =================
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being served", ["method"], multiprocess_mode="livesum")
+HTTP_DB_COMMANDS = Histogram(
+    "http_request_db_commands", "MongoDB commands issued per HTTP request", ["method", "route"],
+    buckets=DB_COMMANDS_BUCKETS)
+
+STARTUP_SECONDS = Gauge(
+    "app_startup_seconds", "Time from lifespan start until the worker was ready to serve",
+    multiprocess_mode="max")
+
+# ================= MongoDB =================
+MONGO_COMMANDS = Counter(
+    "mongodb_commands_total", "MongoDB commands by collection", ["command", "collection", "status"])
+MONGO_LATENCY = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection", ["command", "collection"],
+    buckets=DB_LATENCY_BUCKETS)
+POOL_CONNECTIONS = Gauge(
+    "mongodb_pool_connections", "Open pool connections", ["address"], multiprocess_mode="livesum")
+POOL_CHECKED_OUT = Gauge(
+    "mongodb_pool_checked_out", "Pool connections in use", ["address"], multiprocess_mode="livesum")
+POOL_CHECKOUT_WAIT = Histogram(
+    "mongodb_pool_checkout_seconds", "Time spent waiting for a pool connection", ["address"],
+    buckets=DB_LATENCY_BUCKETS)
+POOL_CHECKOUT_FAILURES = Counter(
+    "mongodb_pool_checkout_failures_total", "Failed connection checkouts", ["address", "reason"])
+
+# Commands issued by the current request: [count]. Motor copies the context into
+# its executor threads, so the command listener sees the request's list.
+_request_commands = contextvars.ContextVar("request_commands", default=None)
+
+# Commands whose first field isn't a collection name
+_NO_COLLECTION = {"ping", "hello", "isMaster", "ismaster", "buildInfo", "endSessions", "listCollections",
+                  "listDatabases", "saslStart", "saslContinue", "getMore", "killCursors"}
+_collection_labels = {}
+
+
+def collection_label(name, database_name: str) -> str:
+    """
+    Per-user collections ("alice_todos") are reported by kind ("todo_blocks")
+    to bound cardinality. Only the app database holds those; collections of
+    any other database (users, password_otps, ...) keep their own name.
+    """
+    if not isinstance(name, str):
+        return "-"
+    label = _collection_labels.get((database_name, name))
+    if label is None:
+        import database  # database and storage both import this module
+        import storage
+        classified = storage.classify_collection(name) if database_name == database.APP_DB_NAME else None
+        label = storage.KINDS[classified[0]][0] if classified else name
+        if len(_collection_labels) > 10000:
+            _collection_labels.clear()
+        _collection_labels[(database_name, name)] = label
+    return label
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}  # (connection_id, request_id) -> collection label
+
+    def started(self, event):
+        name = event.command_name
+        collection = "-" if name in _NO_COLLECTION else collection_label(event.command.get(name), event.database_name)
+        self._collections[(event.connection_id, event.request_id)] = collection
+        counter = _request_commands.get()
+        if counter is not None:
+            counter[0] += 1
+
+    def _finish(self, event, status: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        MONGO_COMMANDS.labels(event.command_name, collection, status).inc()
+        MONGO_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.labels(self._address(event)).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.labels(self._address(event)).dec()
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        POOL_CHECKOUT_FAILURES.labels(self._address(event), str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        address = self._address(event)
+        POOL_CHECKED_OUT.labels(address).inc()
+        duration = getattr(event, "duration", None)  # pymongo >= 4.7
+        if duration is not None:
+            POOL_CHECKOUT_WAIT.labels(address).observe(duration)
+
+    def connection_checked_in(self, event):
+        POOL_CHECKED_OUT.labels(self._address(event)).dec()
+
+
+def mongo_listeners() -> list:
+    """Listeners for database._build_client (none when metrics are off)."""
+    if not METRICS_ENABLED:
+        return []
+    return [CommandMetrics(), PoolMetrics()]
+
+
+# ================= Middleware / endpoint =================
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed until their last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        commands = [0]
+        token = _request_commands.set(commands)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.labels(method).inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_PROGRESS.labels(method).dec()
+            _request_commands.reset(token)
+            # The router stores the matched route in the scope; its path is the template
+            route = getattr(scope.get("route"), "path", None) or UNMATCHED_ROUTE
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_LATENCY.labels(method, route).observe(elapsed)
+            HTTP_DB_COMMANDS.labels(method, route).observe(commands[0])
+
+
+def metrics_response() -> Response:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal
 from datetime import datetime
 
 class Note(BaseModel):
@@ -16,6 +16,16 @@ class Note(BaseModel):
         }
 
 
+class NoteBulkOp(BaseModel):
+    op: Literal["upsert", "delete"] = "upsert"
+    id: Optional[str] = None           # upsert without id creates a new note
+    title: Optional[str] = None        # omitted fields are left as they are ("" on create)
+    content: Optional[str] = None
+
+class NoteBulkIn(BaseModel):
+    ops: List[NoteBulkOp]
+
+
 # ================= AUTH MODELS =================
 class UserCreate(BaseModel):
     name: str
@@ -55,6 +65,25 @@ class TodoBlockIn(BaseModel):
     title: Optional[str] = "Untitled List"
     items: Optional[List[TodoItemIn]] = None
 
+class TodoItemPatch(BaseModel):
+    # only the fields that are sent get changed
+    text: Optional[str] = None
+    done: Optional[bool] = None
+    reminderDate: Optional[str] = None
+    reminderTime: Optional[str] = None
+
+class TodoItemOrder(BaseModel):
+    order: List[int]                   # item ids in the new order; missing ids keep their relative order at the end
+
+class TodoBulkOp(BaseModel):
+    op: Literal["upsert", "delete"] = "upsert"
+    id: Optional[str] = None           # upsert without id creates a new block
+    title: Optional[str] = None
+    items: Optional[List[TodoItemIn]] = None   # replaces the whole list when given
+
+class TodoBulkIn(BaseModel):
+    ops: List[TodoBulkOp]
+
 # Response models (what API returns)
 class TodoItem(BaseModel):
     id: int
@@ -0,0 +1,137 @@
+# note_body.py
+# How note bodies are stored. Every note carries a precomputed "snippet" (the
+# start of the body, whitespace collapsed) and "size" (UTF-8 bytes), so list
+# views can project summaries without reading bodies. Bodies of at least
+# NOTE_COMPRESS_MIN_BYTES are stored compressed:
+#   small: {title, content, snippet, size}
+#   large: {title, content_z, codec, snippet, size}
+# and are only decompressed when a full note is served. The codec is recorded
+# per note, so changing NOTE_COMPRESSION never strands existing documents.
+#
+# zstd needs the optional zstandard package (pip install zstandard); without it
+# new bodies use zlib. Notes saved before this layout can be converted with:
+#   python note_body.py backfill
+import argparse
+import asyncio
+import os
+import zlib
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from pymongo import UpdateOne
+from database import get_app_db, connect, close
+import storage
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+NOTE_COMPRESSION = os.getenv("NOTE_COMPRESSION", "zstd" if zstandard else "zlib")  # "off" disables
+NOTE_COMPRESS_MIN_BYTES = int(os.getenv("NOTE_COMPRESS_MIN_BYTES", "4096"))
+NOTE_SNIPPET_CHARS = int(os.getenv("NOTE_SNIPPET_CHARS", "200"))
+BACKFILL_BATCH_SIZE = 500
+
+# Every stored field derived from the body; a write sets some and unsets the rest
+BODY_FIELDS = ("content", "content_z", "codec", "snippet", "size")
+
+
+def _compress(codec: str, raw: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return zlib.compress(raw, 6)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("note stored with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def make_snippet(content: str) -> str:
+    return " ".join(content[: NOTE_SNIPPET_CHARS * 2].split())[:NOTE_SNIPPET_CHARS]
+
+
+def encode(content: str) -> dict:
+    """Stored fields for a note body."""
+    raw = content.encode("utf-8")
+    fields = {"snippet": make_snippet(content), "size": len(raw)}
+    if NOTE_COMPRESSION != "off" and len(raw) >= NOTE_COMPRESS_MIN_BYTES:
+        packed = _compress(NOTE_COMPRESSION, raw)
+        if len(packed) < len(raw):  # incompressible bodies stay as they are
+            fields.update(content_z=packed, codec=NOTE_COMPRESSION)
+            return fields
+    fields["content"] = content
+    return fields
+
+
+def update(content: str) -> tuple[dict, dict]:
+    """($set, $unset) replacing whatever body a note had with this one."""
+    fields = encode(content)
+    return fields, {f: "" for f in BODY_FIELDS if f not in fields}
+
+
+def content_of(note: dict) -> str:
+    if note.get("content_z") is not None:
+        return _decompress(note.get("codec", "zlib"), note["content_z"]).decode("utf-8")
+    return note.get("content", "")
+
+
+def snippet_of(note: dict) -> str:
+    if "snippet" in note:
+        return note["snippet"]
+    return make_snippet(note.get("content", ""))  # written before snippets were stored
+
+
+def size_of(note: dict) -> int:
+    if "size" in note:
+        return note["size"]
+    return len(note.get("content", "").encode("utf-8"))
+
+
+# ================= Backfill =================
+async def backfill_collection(coll_name: str, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Add snippet/size (and compress large bodies) on notes that predate them."""
+    coll = get_app_db()[coll_name]
+    converted = 0
+    batch = []
+    async for doc in coll.find({"size": {"$exists": False}}, {"content": 1}):
+        fields, unset = update(doc.get("content", ""))
+        batch.append(UpdateOne({"_id": doc["_id"], "size": {"$exists": False}}, {"$set": fields, "$unset": unset}))
+        if len(batch) >= batch_size:
+            await coll.bulk_write(batch, ordered=False)
+            converted += len(batch)
+            batch = []
+    if batch:
+        await coll.bulk_write(batch, ordered=False)
+        converted += len(batch)
+    return converted
+
+
+async def backfill():
+    # The shared notes collection, then every legacy per-user one; nothing else
+    coll_names = [storage.KINDS["notes"][0]]
+    coll_names += [name async for name, kind, _ in storage.tenant_collections() if kind == "notes"]
+    for coll_name in coll_names:
+        converted = await backfill_collection(coll_name)
+        print(f"{coll_name}: {converted} notes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NoteKit note storage tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="store snippet/size and compress large bodies of existing notes")
+    parser.parse_args()
+
+    async def run():
+        await connect()
+        try:
+            await backfill()
+        finally:
+            await close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
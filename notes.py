@@ -1,31 +1,74 @@
-from fastapi import APIRouter, HTTPException, Query
-from models import Note
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from typing import Optional
+from models import Note, NoteBulkIn
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
+from storage import tenant_collection
+import attachments
+import bulk
+import note_body
+import search
+import versioning
+from listing import MAX_PAGE_SIZE, fetch_page, parse_fields, pick_fields, projection_for, stream_ndjson, wants_ndjson
+from fast_json import render
 import os
-from dotenv import load_dotenv
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
 
-load_dotenv()
 router = APIRouter(prefix="/api/notes", tags=["Notes"])
 
-MONGO_URI = os.getenv("MONGO_URI")
-client = AsyncIOMotorClient(MONGO_URI)
-db = client["NOTEkiT"]
+# Payloads here are built by note_serializer, so they go straight to the JSON
+# encoder instead of through jsonable_encoder. Set to 0 to turn that off.
+TRUSTED_RESPONSES = os.getenv("NOTES_TRUSTED_RESPONSES", "1") == "1"
+
+NOTE_FIELDS = {"title", "content", "snippet", "size", "attachments"}
+# Stored fields each API field is built from (large bodies are compressed, see note_body.py)
+NOTE_STORED_FIELDS = {"content": ("content", "content_z", "codec")}
 
 
 def note_serializer(note) -> dict:
     return {
         "id": str(note["_id"]),
-        "title": note["title"],
-        "content": note["content"],
+        "title": note.get("title", ""),
+        "content": note_body.content_of(note),
+        "attachments": note.get("attachments", []),  # references only, see attachments.py
     }
 
 
+def serializer_for(fields: list | None):
+    """Full notes by default; with ?fields, bodies are only read (and decompressed) if content is asked for."""
+    if fields is None:
+        return note_serializer
+
+    def serialize(note) -> dict:
+        out = {
+            "id": str(note["_id"]),
+            "title": note.get("title", ""),
+            "snippet": note_body.snippet_of(note),
+            "size": note_body.size_of(note),
+        }
+        if "content" in fields:
+            out["content"] = note_body.content_of(note)
+        if "attachments" in fields:
+            out["attachments"] = note.get("attachments", [])
+        return out
+
+    return serialize
+
+
 def get_user_collection(username: str):
     """Return collection for the given username."""
     if not username:
         raise HTTPException(status_code=400, detail="Username is required in request")
-    return db[username]  # Dynamic collection per user
+    return tenant_collection("notes", username)  # per-user or shared, see storage.py
+
+
+def parse_note_id(id: str) -> ObjectId:
+    """A malformed id can't name a note: 404, like any other missing note."""
+    try:
+        return ObjectId(id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=404, detail=f"Note not found with id {id}")
 
 
 @router.post("")
@@ -34,44 +77,219 @@ async def create_note(note: Note, username: str = Query(...)):
     notes_collection = get_user_collection(username)
     note_dict = note.dict(by_alias=True)
     note_dict.pop("_id", None)
-    result = await notes_collection.insert_one(note_dict)
-    new_note = await notes_collection.find_one({"_id": result.inserted_id})
-    return note_serializer(new_note)
+    content = note_dict.pop("content")
+    note_dict.update(note_body.encode(content))
+    note_dict.update(versioning.version_fields())
+    await notes_collection.insert_one(note_dict)  # sets note_dict["_id"]
+    saved = {"_id": note_dict["_id"], "title": note.title, "content": content}
+    search.note_saved(username, saved)
+    return render(note_serializer(saved), TRUSTED_RESPONSES)
+
+
+@router.post("/bulk")
+async def bulk_notes(body: NoteBulkIn, username: str = Query(...)):
+    """
+    Apply a batch of upserts and deletes in one unordered bulk write.
+    Returns one result per operation: created, updated, deleted, not_found or error.
+    """
+    notes_collection = get_user_collection(username)
+    ids, results = bulk.resolve_ids(body.ops)
+    to_delete = [ids[i] for i, op in enumerate(body.ops) if op.op == "delete" and i not in results]
+    present = await bulk.existing_ids(notes_collection, to_delete)
+
+    requests = {}
+    for i, op in enumerate(body.ops):
+        if i in results:
+            continue
+        selector = notes_collection.scope({"_id": ids[i]})
+        if op.op == "delete":
+            if ids[i] in present:
+                requests[i] = DeleteOne(selector)
+            else:
+                results[i] = bulk.result(i, ids[i], "not_found")
+            continue
+        given, defaults = {}, {}
+        if op.title is not None:
+            given["title"] = op.title
+        else:
+            defaults["title"] = ""
+        update = {}
+        if op.content is not None:
+            stored, stale = note_body.update(op.content)
+            given.update(stored)
+            update["$unset"] = stale
+        else:
+            defaults.update(note_body.encode(""))
+        update["$set"] = {**given, **versioning.version_fields()}
+        if defaults:
+            update["$setOnInsert"] = defaults
+        requests[i] = UpdateOne(selector, update, upsert=True)
+
+    upserted, errors = await bulk.execute(notes_collection, requests)
+    deleted, partial = [], False
+    for i in requests:
+        op = body.ops[i]
+        if i in errors:
+            results[i] = bulk.result(i, ids[i], "error", errors[i])
+        elif op.op == "delete":
+            results[i] = bulk.result(i, ids[i], "deleted")
+            deleted.append(str(ids[i]))
+        else:
+            results[i] = bulk.result(i, ids[i], "created" if i in upserted else "updated")
+            if op.title is None or op.content is None:
+                partial = True
+            else:
+                search.note_saved(username, {"_id": ids[i], "title": op.title, "content": op.content})
+
+    await versioning.record_deletions(username, "note", deleted)
+    await attachments.delete_for_notes(username, deleted)
+    if partial:
+        search.forget_user(username)  # don't know the untouched fields; rebuild on next search
+    else:
+        for note_id in deleted:
+            search.note_deleted(username, note_id)
+    return render({"results": [results[i] for i in range(len(body.ops))]}, TRUSTED_RESPONSES)
 
 
 @router.get("")
-async def get_all_notes(username: str = Query(...)):
-    """Get all notes for a specific user."""
+async def get_all_notes(
+    request: Request,
+    response: Response,
+    username: str = Query(...),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="comma-separated, e.g. title"),
+):
+    """
+    Get notes for a specific user.
+    Without limit/after this returns the full list; with them it returns
+    {"items": [...], "next_cursor": ...} pages in _id order.
+    Send Accept: application/x-ndjson to stream every note instead.
+    fields=title,snippet,size lists summaries without reading note bodies.
+    Responses carry an ETag; If-None-Match with an unchanged list gets a 304.
+    """
     notes_collection = get_user_collection(username)
-    notes = []
-    async for note in notes_collection.find():
-        notes.append(note_serializer(note))
-    return notes
+    wanted = parse_fields(fields, NOTE_FIELDS)
+    etag = await versioning.collection_etag(notes_collection, request)
+    if versioning.not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    serializer = serializer_for(wanted)
+    if wants_ndjson(request):
+        streamed = stream_ndjson(notes_collection, serializer, after, wanted, stored=NOTE_STORED_FIELDS)
+        streamed.headers["ETag"] = etag
+        return streamed
+    if limit is not None or after is not None:
+        page = await fetch_page(notes_collection, serializer, limit or MAX_PAGE_SIZE, after, wanted,
+                                stored=NOTE_STORED_FIELDS)
+        return render(page, TRUSTED_RESPONSES, headers={"ETag": etag})
+
+    cursor = notes_collection.find({}, projection_for(wanted, NOTE_STORED_FIELDS))
+    notes = [pick_fields(serializer(note), wanted) async for note in cursor]
+    return render(notes, TRUSTED_RESPONSES, headers={"ETag": etag})
+
+
+@router.get("/search")
+async def search_notes(
+    username: str = Query(...),
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
+    """Relevance-ranked search over title and content; returns snippets, not full bodies."""
+    notes_collection = get_user_collection(username)
+    results = await search.search_notes(username, notes_collection, q, limit, offset)
+    return render(results, TRUSTED_RESPONSES)
 
 
 @router.put("/{id}")
 async def update_note(id: str, updated_note: Note, username: str = Query(...)):
     """Update a specific note for a specific user."""
     notes_collection = get_user_collection(username)
-    result = await notes_collection.update_one(
-        {"_id": ObjectId(id)}, {"$set": updated_note.dict(by_alias=True)}
+    fields = updated_note.dict(by_alias=True)
+    body, stale = note_body.update(fields.pop("content"))
+    updated = await notes_collection.find_one_and_update(
+        {"_id": parse_note_id(id)},
+        {"$set": {**fields, **body, **versioning.version_fields()}, "$unset": stale},
+        projection={"_id": 1, "attachments": 1},
+        return_document=ReturnDocument.AFTER,
     )
-    if result.matched_count == 0:
+    if not updated:
         raise HTTPException(status_code=404, detail=f"Note not found with id {id}")
-    updated = await notes_collection.find_one({"_id": ObjectId(id)})
-    return note_serializer(updated)
+    saved = {**updated, "title": updated_note.title, "content": updated_note.content}
+    search.note_saved(username, saved)
+    return render(note_serializer(saved), TRUSTED_RESPONSES)
 
 
 @router.delete("/{id}")
 async def delete_note(id: str, username: str = Query(...)):
     """Delete a specific note for a specific user."""
     notes_collection = get_user_collection(username)
-    result = await notes_collection.delete_one({"_id": ObjectId(id)})
+    result = await notes_collection.delete_one({"_id": parse_note_id(id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail=f"Note not found with id {id}")
+    await versioning.record_deletion(username, "note", id)
+    await attachments.delete_for_notes(username, [id])
+    search.note_deleted(username, id)
     return {"message": f"Note {id} deleted successfully"}
 
 
 @router.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+
+# ================= Attachments =================
+@router.post("/{id}/attachments")
+async def upload_attachments(id: str, request: Request, username: str = Query(...)):
+    """
+    Attach files to a note. Send multipart/form-data with one or more file
+    parts (any field name); they are streamed into GridFS as they arrive.
+    """
+    notes_collection = get_user_collection(username)
+    note_id = parse_note_id(id)
+    if not await notes_collection.find_one({"_id": note_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail=f"Note not found with id {id}")
+    refs = await attachments.receive_files(request, username, str(note_id))
+    if not refs:
+        raise HTTPException(status_code=400, detail="No files in request")
+    result = await notes_collection.update_one(
+        {"_id": note_id},
+        {"$push": {"attachments": {"$each": refs}}, "$set": versioning.version_fields()},
+    )
+    if result.matched_count == 0:  # note deleted while uploading
+        await attachments.delete_files([ref["id"] for ref in refs])
+        raise HTTPException(status_code=404, detail=f"Note not found with id {id}")
+    return render({"attachments": refs}, TRUSTED_RESPONSES)
+
+
+@router.get("/{id}/attachments/{attachment_id}")
+async def download_attachment(id: str, attachment_id: str, request: Request, username: str = Query(...)):
+    """Stream an attachment; supports Range (single range), If-Range and If-None-Match."""
+    get_user_collection(username)
+    grid_out = await attachments.open_file(username, id, attachment_id)
+    return attachments.download_response(grid_out, request)
+
+
+@router.delete("/{id}/attachments/{attachment_id}")
+async def delete_attachment(id: str, attachment_id: str, username: str = Query(...)):
+    notes_collection = get_user_collection(username)
+    result = await notes_collection.update_one(
+        {"_id": parse_note_id(id), "attachments.id": attachment_id},
+        {"$pull": {"attachments": {"id": attachment_id}}, "$set": versioning.version_fields()},
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=404, detail=f"Attachment not found with id {attachment_id}")
+    await attachments.delete_files([attachment_id])
+    return {"message": f"Attachment {attachment_id} deleted successfully"}
+
+
+# Declared after the fixed GET paths above, which it would otherwise shadow
+@router.get("/{id}")
+async def get_note(id: str, username: str = Query(...)):
+    """Get one full note, body decompressed."""
+    notes_collection = get_user_collection(username)
+    note = await notes_collection.find_one({"_id": parse_note_id(id)})
+    if not note:
+        raise HTTPException(status_code=404, detail=f"Note not found with id {id}")
+    return render(note_serializer(note), TRUSTED_RESPONSES)
@@ -0,0 +1,83 @@
+# passwords.py
+# bcrypt password hashing that never runs on the event loop. Hashes are computed
+# in a small dedicated thread pool (bcrypt releases the GIL while it works), and
+# a semaphore sized to that pool makes a login burst wait its turn in asyncio
+# instead of piling work onto every core. Past PASSWORD_HASH_MAX_WAITING queued
+# callers, new ones get a 503 rather than an ever-growing queue.
+import asyncio
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from fastapi import HTTPException
+
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_WAITING = int(os.getenv("PASSWORD_HASH_MAX_WAITING", "200"))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+_waiting = 0
+_running = 0
+
+
+def _secret(password: str) -> bytes:
+    # bcrypt only looks at the first 72 bytes; newer bcrypt releases raise instead of truncating
+    return password.encode("utf-8")[:72]
+
+
+def is_hashed(stored: str | None) -> bool:
+    return bool(stored) and stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def needs_rehash(stored: str) -> bool:
+    """True for hashes made with a different cost than PASSWORD_BCRYPT_ROUNDS."""
+    try:
+        return int(stored.split("$")[2]) != PASSWORD_BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+async def _run(fn, *args):
+    global _waiting, _running
+    if _waiting >= PASSWORD_HASH_MAX_WAITING:
+        raise HTTPException(status_code=503, detail="Too many sign-ins in progress, please retry")
+    _waiting += 1
+    try:
+        await _slots.acquire()
+    finally:
+        _waiting -= 1
+    _running += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _running -= 1
+        _slots.release()
+
+
+async def hash_password(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=PASSWORD_BCRYPT_ROUNDS)
+    hashed = await _run(bcrypt.hashpw, _secret(password), salt)
+    return hashed.decode("ascii")
+
+
+async def verify_password(password: str, stored: str | None) -> tuple[bool, str | None]:
+    """
+    Check a password against a stored value. Returns (ok, new_hash); new_hash is
+    set when the caller should store an upgraded value: a plaintext record from
+    before hashing, or a hash with an outdated cost.
+    """
+    if not stored:
+        return False, None
+    if not is_hashed(stored):
+        ok = hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        return ok, (await hash_password(password) if ok else None)
+    ok = await _run(bcrypt.checkpw, _secret(password), stored.encode("ascii"))
+    if ok and needs_rehash(stored):
+        return True, await hash_password(password)
+    return ok, None
+
+
+def stats() -> dict:
+    return {"workers": PASSWORD_HASH_WORKERS, "running": _running, "waiting": _waiting}
@@ -0,0 +1,322 @@
+# reminders.py
+# Todo reminders, normalized out of the items arrays into one indexed collection:
+#   todo_reminders: {_id: "owner:block:item", owner, block_id, item_id, text, due_at (UTC), fired}
+# The todos router keeps it in sync on every write; a scheduler in each worker
+# keeps a min-heap of reminders due within the next window, refilled from the
+# index, and fires them through a pluggable notifier. Claims are atomic, so
+# several workers can run the scheduler without double-firing.
+#
+# Reminders saved before this index existed can be loaded with:
+#   python reminders.py backfill
+import argparse
+import asyncio
+import heapq
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from pymongo import ASCENDING, DeleteMany, UpdateOne, ReturnDocument
+from database import get_app_db, connect, close
+import indexes
+import storage
+
+logger = logging.getLogger(__name__)
+
+REMINDERS_COLLECTION = storage.REMINDERS_COLLECTION
+
+# reminderDate/reminderTime are wall-clock strings from the client
+REMINDER_TIMEZONE = ZoneInfo(os.getenv("REMINDER_TIMEZONE", "UTC"))
+REMINDER_DEFAULT_TIME = os.getenv("REMINDER_DEFAULT_TIME", "09:00")  # when only a date is set
+REMINDER_SCHEDULER_ENABLED = os.getenv("REMINDER_SCHEDULER_ENABLED", "1") == "1"
+REMINDER_WINDOW_SECONDS = int(os.getenv("REMINDER_WINDOW_SECONDS", "600"))
+REMINDER_REFILL_SECONDS = int(os.getenv("REMINDER_REFILL_SECONDS", "60"))
+REMINDER_HEAP_LIMIT = int(os.getenv("REMINDER_HEAP_LIMIT", "5000"))
+REMINDER_GRACE_SECONDS = int(os.getenv("REMINDER_GRACE_SECONDS", "3600"))  # older misses aren't fired late
+
+REMINDER_INDEXES = [
+    ([("fired", ASCENDING), ("due_at", ASCENDING)], {}),
+    ([("owner", ASCENDING), ("due_at", ASCENDING)], {}),
+    ([("owner", ASCENDING), ("block_id", ASCENDING)], {}),
+]
+for _keys, _options in REMINDER_INDEXES:
+    indexes.declare("app", REMINDERS_COLLECTION, _keys, **_options)
+
+
+def get_reminders_collection():
+    return get_app_db()[REMINDERS_COLLECTION]
+
+
+async def ensure_reminder_indexes():
+    coll = get_reminders_collection()
+    for keys, options in REMINDER_INDEXES:
+        await coll.create_index(keys, **options)
+
+
+def utcnow() -> datetime:
+    # Naive UTC, matching what pymongo hands back for BSON dates
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def due_at_for(item: dict) -> datetime | None:
+    """UTC due time for an item, or None if it has no (valid) reminder or is done."""
+    date = (item.get("reminderDate") or "").strip()
+    if not date or item.get("done"):
+        return None
+    time = (item.get("reminderTime") or "").strip() or REMINDER_DEFAULT_TIME
+    try:
+        local = datetime.fromisoformat(f"{date}T{time}").replace(tzinfo=REMINDER_TIMEZONE)
+    except ValueError:
+        return None
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# Writes that change a todo block's items keep "reminder_count" on the block:
+# its items with a reminder date that are not done. That is an upper bound on
+# the block's reminder documents, so a count of 0 means there is nothing to
+# clean up. A missing count means unknown (older blocks, item-level edits).
+REMINDER_COUNT_FIELD = "reminder_count"
+# The same count as an aggregation expression, for update pipelines
+REMINDER_COUNT = {"$size": {"$filter": {
+    "input": {"$ifNull": ["$items", []]},
+    "as": "it",
+    "cond": {"$and": [
+        {"$ne": [{"$ifNull": ["$$it.reminderDate", ""]}, ""]},
+        {"$ne": ["$$it.done", True]},
+    ]},
+}}}
+
+
+def reminder_count(items: list) -> int:
+    return sum(1 for item in items if (item.get("reminderDate") or "") and not item.get("done"))
+
+
+def _reminder_id(owner: str, block_id: str, item_id: int) -> str:
+    return f"{owner}:{block_id}:{item_id}"
+
+
+def _upsert(owner: str, block_id: str, item: dict, due_at: datetime) -> UpdateOne:
+    # Pipeline update so "fired" only resets when the due time actually moved
+    return UpdateOne(
+        {"_id": _reminder_id(owner, block_id, item["id"])},
+        [{"$set": {
+            "owner": {"$literal": owner},  # strings from the request: never read as field paths
+            "block_id": {"$literal": block_id},
+            "item_id": item["id"],
+            "text": {"$literal": item.get("text", "")},
+            "fired": {"$cond": [{"$eq": ["$due_at", due_at]}, {"$ifNull": ["$fired", False]}, False]},
+            "due_at": due_at,
+        }}],
+        upsert=True,
+    )
+
+
+async def sync_block(owner: str, block_id: str, items: list):
+    """Make the index match a block's full item list (one bulk write)."""
+    await sync_blocks(owner, {block_id: items})
+
+
+async def sync_blocks(owner: str, blocks: dict):
+    """Same as sync_block for {block_id: items} of many blocks, still one bulk write."""
+    ops, due_times = [], []
+    for block_id, items in blocks.items():
+        due = [(item, due_at_for(item)) for item in items]
+        due = [(item, d) for item, d in due if d is not None]
+        keep = [item["id"] for item, _ in due]
+        ops.append(DeleteMany({"owner": owner, "block_id": block_id, "item_id": {"$nin": keep}}))
+        ops += [_upsert(owner, block_id, item, d) for item, d in due]
+        due_times += [d for _, d in due]
+    if not ops:
+        return
+    await get_reminders_collection().bulk_write(ops, ordered=True)
+    for d in due_times:
+        scheduler.wake_if_due(d)
+
+
+async def sync_item(owner: str, block_id: str, item: dict):
+    due_at = due_at_for(item)
+    coll = get_reminders_collection()
+    if due_at is None:
+        await coll.delete_one({"_id": _reminder_id(owner, block_id, item["id"])})
+        return
+    await coll.bulk_write([_upsert(owner, block_id, item, due_at)])
+    scheduler.wake_if_due(due_at)
+
+
+async def remove_item(owner: str, block_id: str, item_id: int):
+    await get_reminders_collection().delete_one({"_id": _reminder_id(owner, block_id, item_id)})
+
+
+async def remove_block(owner: str, block_id: str):
+    await get_reminders_collection().delete_many({"owner": owner, "block_id": block_id})
+
+
+async def remove_blocks(owner: str, block_ids: list):
+    if block_ids:
+        await get_reminders_collection().delete_many({"owner": owner, "block_id": {"$in": block_ids}})
+
+
+async def upcoming(owner: str, within: timedelta, limit: int) -> list:
+    now = utcnow()
+    cursor = get_reminders_collection().find(
+        {"owner": owner, "due_at": {"$gte": now, "$lte": now + within}},
+        {"_id": 0, "owner": 0},
+    ).sort([("due_at", ASCENDING)]).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+# ================= Notifiers =================
+class LogNotifier:
+    """Default notifier: just logs. Swap in anything with `async def notify(reminder)`."""
+
+    async def notify(self, reminder: dict):
+        logger.info("reminder due for %s: %s (block %s, item %s)",
+                    reminder["owner"], reminder.get("text", ""), reminder["block_id"], reminder["item_id"])
+
+
+# ================= Scheduler =================
+class ReminderScheduler:
+    def __init__(self, notifier=None, window: int = REMINDER_WINDOW_SECONDS, refill: int = REMINDER_REFILL_SECONDS):
+        self.notifier = notifier or LogNotifier()
+        self.window = timedelta(seconds=window)
+        self.refill_every = refill
+        self._heap = []       # (due_at, reminder _id)
+        self._queued = set()  # (due_at, _id) already on the heap
+        self._wake = asyncio.Event()
+        self._task = None
+        self.fired = 0
+
+    def set_notifier(self, notifier):
+        self.notifier = notifier
+
+    def wake_if_due(self, due_at: datetime):
+        """Called on writes: a reminder inside the current window shouldn't wait for the next refill."""
+        if self._task is not None and due_at <= utcnow() + self.window:
+            self._wake.set()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _refill(self):
+        cursor = get_reminders_collection().find(
+            {"fired": False, "due_at": {
+                "$gte": utcnow() - timedelta(seconds=REMINDER_GRACE_SECONDS),
+                "$lte": utcnow() + self.window,
+            }},
+            {"due_at": 1},
+        ).sort([("due_at", ASCENDING)]).limit(REMINDER_HEAP_LIMIT)
+        async for doc in cursor:
+            entry = (doc["due_at"], doc["_id"])
+            if entry not in self._queued:
+                self._queued.add(entry)
+                heapq.heappush(self._heap, entry)
+
+    async def _fire(self, due_at: datetime, reminder_id: str):
+        # Claim by exact due_at: if the item was rescheduled since we loaded it, skip.
+        doc = await get_reminders_collection().find_one_and_update(
+            {"_id": reminder_id, "fired": False, "due_at": due_at},
+            {"$set": {"fired": True, "fired_at": utcnow()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return
+        try:
+            await self.notifier.notify(doc)
+            self.fired += 1
+        except Exception:
+            logger.exception("reminder notifier failed for %s", reminder_id)
+
+    async def _run(self):
+        next_refill = 0.0
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if loop.time() >= next_refill or self._wake.is_set():
+                    self._wake.clear()
+                    await self._refill()
+                    next_refill = loop.time() + self.refill_every
+
+                now = utcnow()
+                while self._heap and self._heap[0][0] <= now:
+                    entry = heapq.heappop(self._heap)
+                    self._queued.discard(entry)
+                    await self._fire(*entry)
+
+                sleep_for = next_refill - loop.time()
+                if self._heap:
+                    sleep_for = min(sleep_for, (self._heap[0][0] - utcnow()).total_seconds())
+                try:
+                    await asyncio.wait_for(self._wake.wait(), max(sleep_for, 0.05))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("reminder scheduler iteration failed")
+                await asyncio.sleep(self.refill_every)
+
+    def stats(self) -> dict:
+        return {"running": self._task is not None, "queued": len(self._heap), "fired": self.fired}
+
+
+scheduler = ReminderScheduler()
+
+
+async def start_scheduler():
+    if REMINDER_SCHEDULER_ENABLED:
+        await scheduler.start()
+
+
+async def stop_scheduler():
+    await scheduler.stop()
+
+
+# ================= Backfill =================
+async def backfill():
+    """Index reminders from every existing todo block (per-user and shared collections)."""
+    db = get_app_db()
+    await ensure_reminder_indexes()
+    for coll_name in sorted(await db.list_collection_names()):
+        if coll_name == storage.KINDS["todos"][0]:
+            owner = None  # shared layout: owner is on each document
+        else:
+            classified = storage.classify_collection(coll_name)
+            if classified is None or classified[0] != "todos":
+                continue
+            owner = classified[1]
+        count = 0
+        async for doc in db[coll_name].find({}, {"items": 1, "owner": 1}):
+            await sync_block(owner or doc["owner"], str(doc["_id"]), doc.get("items", []) or [])
+            count += 1
+        print(f"{coll_name}: {count} blocks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NoteKit reminder tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="index reminders from existing todo blocks")
+    parser.parse_args()
+
+    async def run():
+        await connect()
+        try:
+            await backfill()
+        finally:
+            await close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# search.py
+# Ranked note search. Two backends, picked with NOTES_SEARCH_BACKEND:
+#   "text"   - MongoDB text index over title + content, ranked by textScore (default).
+#              Compressed bodies (note_body.py) are opaque to it, so for those
+#              notes it matches the title and the stored snippet only.
+#   "memory" - built-in per-user inverted index with BM25 ranking, for deployments
+#              without text indexes (or a Mongo stand-in). Built on first search,
+#              kept current by the notes router, and evicted after a TTL so other
+#              workers' writes show up.
+import math
+import os
+import re
+from collections import defaultdict
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from pymongo import TEXT
+from pymongo.errors import OperationFailure
+from cache import TTLCache
+from storage import ensure_index
+import note_body
+
+SEARCH_BACKEND = os.getenv("NOTES_SEARCH_BACKEND", "text")
+SEARCH_INDEX_USERS = int(os.getenv("SEARCH_INDEX_USERS", "500"))
+SEARCH_INDEX_TTL_SECONDS = float(os.getenv("SEARCH_INDEX_TTL_SECONDS", "300"))
+SNIPPET_WIDTH = 160
+TITLE_WEIGHT = 2  # a title hit counts as this many body hits
+TEXT_INDEX_KEYS = [("title", TEXT), ("content", TEXT), ("snippet", TEXT)]
+TEXT_INDEX_NAME = "notes_text_snippet"
+LEGACY_TEXT_INDEX_NAME = "notes_text"  # title + content only
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def make_snippet(text: str, terms: list, width: int = SNIPPET_WIDTH) -> str:
+    """Window of text around the first query term, with ellipses where cut."""
+    text = text or ""
+    if len(text) <= width:
+        return text
+    lowered = text.lower()
+    hits = [i for i in (lowered.find(t) for t in terms) if i >= 0]
+    start = max(min(hits) - width // 4, 0) if hits else 0
+    end = min(start + width, len(text))
+    start = max(end - width, 0)
+    snippet = text[start:end].strip()
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+
+class InvertedIndex:
+    """term -> {note_id: weighted term frequency}, scored with BM25."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.docs = {}  # note_id -> (title, content, length)
+        self.total_length = 0
+
+    def add(self, note_id: str, title: str, content: str):
+        self.remove(note_id)
+        freqs = defaultdict(int)
+        for token in tokenize(title):
+            freqs[token] += TITLE_WEIGHT
+        for token in tokenize(content):
+            freqs[token] += 1
+        length = sum(freqs.values())
+        for token, tf in freqs.items():
+            self.postings[token][note_id] = tf
+        self.docs[note_id] = (title or "", content or "", length)
+        self.total_length += length
+
+    def remove(self, note_id: str):
+        doc = self.docs.pop(note_id, None)
+        if doc is None:
+            return
+        title, content, length = doc
+        self.total_length -= length
+        for token in set(tokenize(title)) | set(tokenize(content)):
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(note_id, None)
+                if not posting:
+                    del self.postings[token]
+
+    def search(self, terms: list) -> list:
+        """Return [(note_id, score)] for notes matching any term, best first."""
+        n_docs = len(self.docs)
+        if not n_docs:
+            return []
+        avg_len = self.total_length / n_docs or 1
+        scores = defaultdict(float)
+        for term in set(terms):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for note_id, tf in posting.items():
+                length = self.docs[note_id][2]
+                norm = tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * length / avg_len))
+                scores[note_id] += idf * norm
+        return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+
+
+# username -> InvertedIndex
+_indexes = TTLCache(maxsize=SEARCH_INDEX_USERS, ttl=SEARCH_INDEX_TTL_SECONDS)
+
+
+async def _memory_index(username: str, coll) -> InvertedIndex:
+    index = _indexes.get(username)
+    if index is None:
+        index = InvertedIndex()
+        async for note in coll.find({}, {"title": 1, "content": 1, "content_z": 1, "codec": 1}):
+            index.add(str(note["_id"]), note.get("title", ""), note_body.content_of(note))
+        _indexes.set(username, index)
+    return index
+
+
+def note_saved(username: str, note: dict):
+    """Keep a built in-memory index in step with a created/updated note."""
+    index = _indexes.get(username)
+    if index is not None:
+        index.add(str(note["_id"]), note.get("title", ""), note.get("content", ""))
+
+
+def note_deleted(username: str, note_id: str):
+    index = _indexes.get(username)
+    if index is not None:
+        index.remove(note_id)
+
+
+def forget_user(username: str):
+    """Drop a user's in-memory index; it is rebuilt on their next search."""
+    _indexes.invalidate(username)
+
+
+async def _ensure_text_index(coll):
+    try:
+        await ensure_index(coll, TEXT_INDEX_KEYS, name=TEXT_INDEX_NAME)
+    except OperationFailure:
+        # A collection allows one text index; replace the one from before snippets
+        await coll.collection.drop_index(LEGACY_TEXT_INDEX_NAME)
+        await ensure_index(coll, TEXT_INDEX_KEYS, name=TEXT_INDEX_NAME)
+
+
+async def search_notes(username: str, coll, query: str, limit: int, offset: int = 0) -> dict:
+    terms = tokenize(query)
+    if not terms:
+        return {"items": [], "next_offset": None}
+
+    if SEARCH_BACKEND == "memory":
+        index = await _memory_index(username, coll)
+        ranked = index.search(terms)
+        page = ranked[offset:offset + limit]
+        items = []
+        for note_id, score in page:
+            title, content, _ = index.docs[note_id]
+            items.append({
+                "id": note_id,
+                "title": title,
+                "snippet": make_snippet(content, terms),
+                "score": round(score, 4),
+            })
+        has_more = len(ranked) > offset + limit
+    else:
+        await _ensure_text_index(coll)
+        score = {"$meta": "textScore"}
+        cursor = (
+            coll.find({"$text": {"$search": query}}, {"title": 1, "content": 1, "snippet": 1, "score": score})
+            .sort([("score", score)])
+            .skip(offset)
+            .limit(limit + 1)
+        )
+        docs = await cursor.to_list(length=limit + 1)
+        has_more = len(docs) > limit
+        items = [{
+            "id": str(doc["_id"]),
+            "title": doc.get("title", ""),
+            "snippet": make_snippet(doc["content"], terms) if "content" in doc else doc.get("snippet", ""),
+            "score": round(doc.get("score", 0.0), 4),
+        } for doc in docs[:limit]]
+
+    return {"items": items, "next_offset": offset + limit if has_more else None}
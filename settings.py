@@ -0,0 +1,7 @@
+# settings.py
+# Loads .env into the environment once per process. Every module reads its own
+# options with os.getenv at import time, so each one imports this module first;
+# later imports are free.
+from dotenv import load_dotenv
+
+load_dotenv()
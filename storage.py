@@ -0,0 +1,305 @@
+# storage.py
+# Tenant-aware collection access.
+#
+# STORAGE_MODE=per_user (default) keeps the legacy layout: one collection per user
+# per feature ("alice", "alice_todos", "alice_templates", "alice_task_streaks").
+# STORAGE_MODE=shared puts every tenant into one collection per feature and scopes
+# every query with an "owner" field backed by (owner, ...) compound indexes.
+#
+# Migrating an existing database (safe to run while the app is serving):
+#   python storage.py migrate                 # copy per-user collections in batches
+#   STORAGE_MODE=shared  -> restart workers
+#   python storage.py migrate --drop-source   # catch up late writes, drop old collections
+# Copies never overwrite a newer shared document and never bring back one that
+# was deleted (has a sync tombstone) after the first pass.
+import argparse
+import asyncio
+import os
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import get_app_db, connect, close
+import indexes
+
+STORAGE_MODE = os.getenv("STORAGE_MODE", "per_user")
+SHARED = STORAGE_MODE == "shared"
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "500"))
+
+# kind -> (shared collection name, per-user collection suffix)
+KINDS = {
+    "notes": ("notes", ""),
+    "todos": ("todo_blocks", "_todos"),
+    "templates": ("timetable_templates", "_templates"),
+    "streaks": ("task_streaks", "_task_streaks"),
+}
+
+TOMBSTONES_COLLECTION = "sync_tombstones"   # versioning.py
+REMINDERS_COLLECTION = "todo_reminders"     # reminders.py
+ATTACHMENTS_BUCKET = "note_attachments"     # attachments.py (GridFS)
+
+# Collections in the app database that never belong to a single tenant. Listed
+# here rather than registered by their modules, because the CLIs import only
+# this module and must never take one of these for a user's collection.
+SHARED_COLLECTIONS = {name for name, _ in KINDS.values()} | {
+    TOMBSTONES_COLLECTION,
+    REMINDERS_COLLECTION,
+    f"{ATTACHMENTS_BUCKET}.files",
+    f"{ATTACHMENTS_BUCKET}.chunks",
+}
+
+# Migrated kinds whose deletions leave tombstones, and the tombstone kind
+TOMBSTONE_KINDS = {"notes": "note", "todos": "todo"}
+DUPLICATE_KEY = 11000
+
+SHARED_INDEXES = {
+    "notes": [([("owner", ASCENDING), ("_id", ASCENDING)], {})],
+    "todo_blocks": [([("owner", ASCENDING), ("_id", ASCENDING)], {})],
+    "timetable_templates": [([("owner", ASCENDING)], {})],
+    "task_streaks": [([("owner", ASCENDING), ("slot_id", ASCENDING)], {"unique": True})],
+}
+if SHARED:
+    for _coll_name, _specs in SHARED_INDEXES.items():
+        for _keys, _options in _specs:
+            indexes.declare("app", _coll_name, _keys, **_options)
+
+
+class TenantCollection:
+    """
+    Thin wrapper over a Motor collection that adds the owner scope in shared mode.
+    In per-user mode owner is None and every call passes straight through.
+    """
+
+    def __init__(self, collection, owner: str | None):
+        self.collection = collection
+        self.owner = owner
+
+    @property
+    def name(self):
+        return self.collection.name
+
+    def scope(self, filter: dict | None = None) -> dict:
+        filter = dict(filter or {})
+        if self.owner is not None:
+            filter["owner"] = self.owner
+        return filter
+
+    def stamp(self, doc: dict) -> dict:
+        if self.owner is not None:
+            doc["owner"] = self.owner
+        return doc
+
+    def doc_id(self, local_id: str) -> str:
+        """Map a per-user fixed _id (e.g. "templates") to one that is unique across tenants."""
+        if self.owner is not None:
+            return f"{self.owner}:{local_id}"
+        return local_id
+
+    def find(self, filter=None, *args, **kwargs):
+        return self.collection.find(self.scope(filter), *args, **kwargs)
+
+    async def find_one(self, filter=None, *args, **kwargs):
+        return await self.collection.find_one(self.scope(filter), *args, **kwargs)
+
+    async def insert_one(self, doc, **kwargs):
+        return await self.collection.insert_one(self.stamp(doc), **kwargs)
+
+    async def insert_many(self, docs, **kwargs):
+        return await self.collection.insert_many([self.stamp(d) for d in docs], **kwargs)
+
+    async def update_one(self, filter, update, **kwargs):
+        return await self.collection.update_one(self.scope(filter), update, **kwargs)
+
+    async def update_many(self, filter, update, **kwargs):
+        return await self.collection.update_many(self.scope(filter), update, **kwargs)
+
+    async def delete_one(self, filter, **kwargs):
+        return await self.collection.delete_one(self.scope(filter), **kwargs)
+
+    async def delete_many(self, filter, **kwargs):
+        return await self.collection.delete_many(self.scope(filter), **kwargs)
+
+    async def find_one_and_update(self, filter, update, **kwargs):
+        return await self.collection.find_one_and_update(self.scope(filter), update, **kwargs)
+
+    async def count_documents(self, filter=None, **kwargs):
+        return await self.collection.count_documents(self.scope(filter), **kwargs)
+
+    async def bulk_write(self, requests, **kwargs):
+        """Requests are passed through as-is: build their filters with scope() and inserts with stamp()."""
+        return await self.collection.bulk_write(requests, **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        if self.owner is not None:
+            pipeline = [{"$match": {"owner": self.owner}}] + list(pipeline)
+        return self.collection.aggregate(pipeline, **kwargs)
+
+
+def tenant_collection(kind: str, username: str) -> TenantCollection:
+    shared_name, suffix = KINDS[kind]
+    db = get_app_db()
+    if SHARED:
+        return TenantCollection(db[shared_name], username)
+    return TenantCollection(db[f"{username}{suffix}"], None)
+
+
+_ensured_indexes = set()
+
+
+async def ensure_index(coll: TenantCollection, keys: list, **options):
+    """
+    Create an index on a tenant collection once per process.
+    Per-user collections are created lazily, so their indexes are too; in shared
+    mode the owner prefix is added to match the startup indexes. Returns the
+    keys actually indexed (usable as a hint).
+    """
+    if coll.owner is not None:
+        keys = [("owner", ASCENDING)] + list(keys)
+    marker = (coll.name, tuple(keys))
+    if marker in _ensured_indexes:
+        return keys
+    await coll.collection.create_index(keys, **options)
+    _ensured_indexes.add(marker)
+    return keys
+
+
+async def ensure_shared_indexes():
+    """Create the (owner, ...) indexes the shared layout relies on, whatever STORAGE_MODE is. Idempotent."""
+    db = get_app_db()
+    for coll_name, specs in SHARED_INDEXES.items():
+        for keys, options in specs:
+            await db[coll_name].create_index(keys, **options)
+
+
+# ================= Migration =================
+def classify_collection(coll_name: str):
+    """
+    Return (kind, owner) for what is by its name a legacy per-user collection,
+    or None to skip it. Per-user notes collections are named after the user
+    alone, so a bare name is only a candidate: see tenant_collections().
+    """
+    if coll_name in SHARED_COLLECTIONS or coll_name.startswith("system.") or coll_name.startswith("fs."):
+        return None
+    if coll_name.endswith((".files", ".chunks")):  # any other GridFS bucket
+        return None
+    # Check longer suffixes first so "bob_task_streaks" isn't read as notes
+    for kind, (_, suffix) in sorted(KINDS.items(), key=lambda kv: -len(kv[1][1])):
+        if suffix and coll_name.endswith(suffix) and len(coll_name) > len(suffix):
+            return kind, coll_name[: -len(suffix)]
+    return "notes", coll_name
+
+
+async def _holds_notes(coll) -> bool:
+    """Whether a bare-named collection holds notes (or nothing): un-owned docs with a title or body."""
+    doc = await coll.find_one({}, {"owner": 1, "title": 1, "content": 1, "content_z": 1})
+    if doc is None:
+        return True
+    return "owner" not in doc and any(f in doc for f in ("title", "content", "content_z"))
+
+
+async def tenant_collections():
+    """Yield (collection name, kind, owner) for every legacy per-user collection; unknown ones are skipped."""
+    db = get_app_db()
+    for coll_name in sorted(await db.list_collection_names()):
+        classified = classify_collection(coll_name)
+        if classified is None:
+            continue
+        kind, owner = classified
+        if kind == "notes" and not await _holds_notes(db[coll_name]):
+            print(f"{coll_name}: skipped, not a notes collection")
+            continue
+        yield coll_name, kind, owner
+
+
+async def _deleted_ids(kind: str, owner: str) -> set:
+    tombstone_kind = TOMBSTONE_KINDS.get(kind)
+    if tombstone_kind is None:
+        return set()
+    cursor = get_app_db()[TOMBSTONES_COLLECTION].find({"owner": owner, "kind": tombstone_kind}, {"id": 1})
+    return {doc["id"] async for doc in cursor}
+
+
+def _copy_request(doc: dict):
+    """Insert a missing document, or replace an older copy; never touch a newer one."""
+    version = doc.get("version")
+    if version is None:
+        return UpdateOne({"_id": doc["_id"]}, {"$setOnInsert": {k: v for k, v in doc.items() if k != "_id"}},
+                         upsert=True)
+    # If the shared copy is as new or newer, the filter misses and the upsert
+    # collides on _id; that duplicate-key error is the "keep it" outcome. A copy
+    # without a version (e.g. a streak first copied before marks stamped one) is older.
+    older = [{"version": {"$lt": version}}, {"version": {"$exists": False}}]
+    return ReplaceOne({"_id": doc["_id"], "$or": older}, doc, upsert=True)
+
+
+async def _write_copies(coll, batch: list) -> int:
+    try:
+        result = (await coll.bulk_write(batch, ordered=False)).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        failed = [err for err in result.get("writeErrors", []) if err.get("code") != DUPLICATE_KEY]
+        if failed:
+            raise
+    return len(result.get("upserted", [])) + result.get("nModified", 0)
+
+
+async def migrate_collection(coll_name: str, kind: str, owner: str, batch_size: int = MIGRATION_BATCH_SIZE,
+                             drop_source: bool = False):
+    """
+    Copy one per-user collection into its shared collection; returns how many
+    shared documents were written. Safe to repeat: see _copy_request.
+    """
+    db = get_app_db()
+    source = db[coll_name]
+    target = TenantCollection(db[KINDS[kind][0]], owner)
+    deleted = await _deleted_ids(kind, owner)
+
+    copied = 0
+    batch = []
+    async for doc in source.find().sort([("_id", ASCENDING)]):
+        if str(doc["_id"]) in deleted:
+            continue  # deleted after the switch; the per-user copy is stale
+        if kind == "templates":
+            doc["_id"] = target.doc_id(doc["_id"])
+        target.stamp(doc)
+        batch.append(_copy_request(doc))
+        if len(batch) >= batch_size:
+            copied += await _write_copies(target.collection, batch)
+            batch = []
+    if batch:
+        copied += await _write_copies(target.collection, batch)
+
+    if drop_source:
+        await source.drop()
+    return copied
+
+
+async def migrate(batch_size: int = MIGRATION_BATCH_SIZE, drop_source: bool = False):
+    # Indexes must exist on the targets before copying, whatever mode this process runs in
+    await ensure_shared_indexes()
+    async for coll_name, kind, owner in tenant_collections():
+        copied = await migrate_collection(coll_name, kind, owner, batch_size=batch_size, drop_source=drop_source)
+        if copied:
+            print(f"{coll_name}: {copied} documents")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NoteKit storage tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    m = sub.add_parser("migrate", help="move per-user collections into shared collections")
+    m.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    m.add_argument("--drop-source", action="store_true", help="drop each per-user collection after copying")
+    args = parser.parse_args()
+
+    async def run():
+        await connect()
+        try:
+            await migrate(batch_size=args.batch_size, drop_source=args.drop_source)
+        finally:
+            await close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# sync.py
+from fastapi import APIRouter, Query
+import asyncio
+import os
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from pymongo import ASCENDING
+import notes
+import todos
+import timetable
+import versioning
+
+router = APIRouter(prefix="/api/sync", tags=["Sync"])
+
+# Versions come from each worker's clock; re-send this much history on every
+# poll so a slightly-behind worker's writes aren't skipped. Clients apply
+# changes by id, so the overlap is harmless.
+SYNC_OVERLAP_SECONDS = float(os.getenv("SYNC_OVERLAP_SECONDS", "2"))
+
+
+def _with_version(item: dict, doc: dict) -> dict:
+    item["version"] = doc.get("version", 0)
+    return item
+
+
+@router.get("")
+async def get_changes(username: str = Query(...), since: int = Query(0, ge=0)):
+    """
+    Everything that changed after `since` (the "version" from the previous
+    response; 0 for a first sync). Deletions come back as tombstones. If
+    `since` is older than tombstone retention, "full_resync" is true and the
+    response holds the complete current state instead.
+    """
+    full_resync = 0 < since < versioning.oldest_retained_version()
+    if full_resync:
+        since = 0
+    after = max(since - int(SYNC_OVERLAP_SECONDS * 1_000_000), 0) if since else 0
+    changed = {"version": {"$gt": after}} if after else {}
+    by_version = [("version", ASCENDING)]
+
+    notes_coll = notes.get_user_collection(username)
+    todos_coll = todos.get_user_collection(username)
+    templates_coll = timetable.get_template_collection(username)
+    await versioning.ensure_version_index(notes_coll)
+    await versioning.ensure_version_index(todos_coll)
+
+    async def deleted():
+        if not after:
+            return []  # a full snapshot has nothing to delete
+        cursor = versioning.get_tombstones_collection().find(
+            {"owner": username, "version": {"$gt": after}}, {"_id": 0, "kind": 1, "id": 1, "version": 1}
+        ).sort(by_version)
+        return await cursor.to_list(length=None)
+
+    note_docs, todo_docs, template, tombstones = await asyncio.gather(
+        notes_coll.find(changed).sort(by_version).to_list(length=None),
+        todos_coll.find(changed).sort(by_version).to_list(length=None),
+        templates_coll.find_one({"_id": templates_coll.doc_id("templates"), **changed}),
+        deleted(),
+    )
+
+    versions = [since]
+    versions += [d.get("version", 0) for d in note_docs + todo_docs + tombstones]
+    if template:
+        versions.append(template.get("version", 0))
+        template.pop("_id", None)
+        template.pop("owner", None)
+
+    return {
+        "version": max(versions),
+        "full_resync": full_resync,
+        "notes": [_with_version(notes.note_serializer(d), d) for d in note_docs],
+        "todos": [_with_version(todos.todo_serializer(d), d) for d in todo_docs],
+        "templates": template,
+        "deleted": tombstones,
+    }
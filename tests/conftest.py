@@ -0,0 +1,8 @@
+# tests/conftest.py
+# The app modules are flat files at the repo root; make them importable however
+# pytest is started.  Run with: python -m pytest -q
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")  # never connected to by these tests
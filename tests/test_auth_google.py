@@ -0,0 +1,187 @@
+# tests/test_auth_google.py
+# google_callback with Google's endpoints served by an httpx.MockTransport and
+# the users collection by mongomock.
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+import auth_google
+import database
+import http_client
+from authent import get_users_collection
+
+CLIENT_ID = "client-123.apps.googleusercontent.com"
+EMAIL = "ada@example.com"
+
+
+def _rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+KEYS = {"k1": _rsa_key(), "k2": _rsa_key()}
+
+
+def _jwk(kid: str) -> dict:
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(KEYS[kid].public_key()))
+    return {**jwk, "kid": kid, "alg": "RS256", "use": "sig"}
+
+
+def _id_token(kid: str = "k1", **overrides) -> str:
+    now = int(time.time())
+    claims = {"iss": "https://accounts.google.com", "aud": CLIENT_ID, "sub": "1234", "iat": now,
+              "exp": now + 600, "email": EMAIL, "email_verified": True, "name": "Ada"}
+    claims.update(overrides)
+    return jwt.encode(claims, KEYS[kid], algorithm="RS256", headers={"kid": kid})
+
+
+class FakeGoogle:
+    """Token, userinfo and certs endpoints; records every request it serves."""
+
+    def __init__(self, id_token: str | None = None, published=("k1",)):
+        self.id_token = id_token
+        self.published = list(published)
+        self.requests = []
+
+    def paths(self) -> list:
+        return [r.url.path for r in self.requests]
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.url.path == "/token":
+            tokens = {"access_token": "access-abc", "token_type": "Bearer"}
+            if self.id_token:
+                tokens["id_token"] = self.id_token
+            return httpx.Response(200, json=tokens)
+        if request.url.path == "/oauth2/v2/userinfo":
+            assert request.headers["authorization"] == "Bearer access-abc"
+            return httpx.Response(200, json={"email": EMAIL, "name": "Ada", "verified_email": True})
+        if request.url.path == "/oauth2/v3/certs":
+            return httpx.Response(200, json={"keys": [_jwk(kid) for kid in self.published]},
+                                  headers={"cache-control": "public, max-age=3600"})
+        return httpx.Response(404)
+
+
+@pytest.fixture(autouse=True)
+def google_config(monkeypatch):
+    monkeypatch.setattr(auth_google, "CLIENT_ID", CLIENT_ID)
+    monkeypatch.setattr(auth_google, "VERIFY_ID_TOKEN", False)
+    monkeypatch.setattr(auth_google, "google_jwks", auth_google.JWKSCache())
+
+
+def _callback(google: FakeGoogle):
+    """Run the callback once; returns (response or HTTPException, stored user)."""
+    async def run():
+        await database.connect(client=AsyncMongoMockClient())
+        await http_client.start(transport=httpx.MockTransport(google))
+        try:
+            try:
+                result = await auth_google.google_callback(code="auth-code")
+            except HTTPException as e:
+                result = e
+            return result, await get_users_collection().find_one({"email": EMAIL})
+        finally:
+            await http_client.close()
+
+    return asyncio.run(run())
+
+
+def _redirect_params(response) -> dict:
+    assert response.status_code == 307
+    return {k: v[0] for k, v in parse_qs(urlparse(response.headers["location"]).query).items()}
+
+
+def test_userinfo_path_creates_user_and_redirects_with_token():
+    google = FakeGoogle()
+    response, user = _callback(google)
+
+    params = _redirect_params(response)
+    assert params["email"] == EMAIL
+    assert jwt.decode(params["token"], options={"verify_signature": False})["sub"] == EMAIL
+    assert user["auth_provider"] == "google" and user["name"] == "Ada"
+    assert google.paths() == ["/token", "/oauth2/v2/userinfo"]
+    assert google.requests[0].method == "POST"
+    assert parse_qs(google.requests[0].content.decode())["code"] == ["auth-code"]
+
+
+def test_verified_id_token_skips_userinfo(monkeypatch):
+    monkeypatch.setattr(auth_google, "VERIFY_ID_TOKEN", True)
+    google = FakeGoogle(id_token=_id_token())
+    response, user = _callback(google)
+
+    assert _redirect_params(response)["email"] == EMAIL
+    assert user is not None
+    assert google.paths() == ["/token", "/oauth2/v3/certs"]
+
+
+def test_unknown_kid_refreshes_jwks(monkeypatch):
+    monkeypatch.setattr(auth_google, "VERIFY_ID_TOKEN", True)
+    cache = auth_google.google_jwks
+    # Fresh cache holding only k1, last fetched longer ago than the refresh rate limit
+    cache.keys = {"k1": jwt.PyJWK(_jwk("k1"))}
+    cache.fetched_at = time.monotonic() - auth_google.JWKS_MIN_REFRESH_SECONDS - 1
+    cache.expires_at = time.monotonic() + 3600
+    google = FakeGoogle(id_token=_id_token(kid="k2"), published=("k1", "k2"))
+
+    response, _ = _callback(google)
+
+    assert _redirect_params(response)["email"] == EMAIL
+    assert google.paths().count("/oauth2/v3/certs") == 1
+    assert set(cache.keys) == {"k1", "k2"}
+
+
+def test_unknown_kid_within_rate_limit_is_rejected(monkeypatch):
+    monkeypatch.setattr(auth_google, "VERIFY_ID_TOKEN", True)
+    cache = auth_google.google_jwks
+    cache.keys = {"k1": jwt.PyJWK(_jwk("k1"))}
+    cache.fetched_at = time.monotonic()
+    cache.expires_at = time.monotonic() + 3600
+    google = FakeGoogle(id_token=_id_token(kid="k2"), published=("k1", "k2"))
+
+    error, user = _callback(google)
+
+    assert isinstance(error, HTTPException) and error.status_code == 401
+    assert "/oauth2/v3/certs" not in google.paths()
+    assert user is None
+
+
+@pytest.mark.parametrize("claims", [
+    {"aud": "someone-else.apps.googleusercontent.com"},
+    {"iss": "https://evil.example.com"},
+    {"exp": int(time.time()) - 3600},
+])
+def test_id_token_with_wrong_audience_issuer_or_expiry_is_rejected(monkeypatch, claims):
+    monkeypatch.setattr(auth_google, "VERIFY_ID_TOKEN", True)
+    google = FakeGoogle(id_token=_id_token(**claims))
+
+    error, user = _callback(google)
+
+    assert isinstance(error, HTTPException) and error.status_code == 401
+    assert user is None
+
+
+def test_id_token_signed_by_another_key_is_rejected(monkeypatch):
+    monkeypatch.setattr(auth_google, "VERIFY_ID_TOKEN", True)
+    forged = jwt.encode(jwt.decode(_id_token(kid="k2"), options={"verify_signature": False}),
+                        KEYS["k2"], algorithm="RS256", headers={"kid": "k1"})
+    error, user = _callback(FakeGoogle(id_token=forged))
+
+    assert isinstance(error, HTTPException) and error.status_code == 401
+    assert user is None
+
+
+def test_unverified_email_is_rejected(monkeypatch):
+    monkeypatch.setattr(auth_google, "VERIFY_ID_TOKEN", True)
+    google = FakeGoogle(id_token=_id_token(email_verified=False))
+
+    error, user = _callback(google)
+
+    assert isinstance(error, HTTPException) and error.status_code == 400
+    assert user is None
@@ -0,0 +1,191 @@
+# tests/test_mailer.py
+# The outbox against a local SMTP stand-in (aiosmtpd in a thread).
+import asyncio
+import socket
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+from mongomock_motor import AsyncMongoMockClient
+
+from mailer import EmailOutbox
+
+
+class Recorder:
+    """aiosmtpd handler that keeps every delivered message (and the connection it came on)."""
+
+    def __init__(self):
+        self.messages = []
+        self.on_message = None
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((session.peer, envelope.rcpt_tos[0]))
+        if self.on_message is not None:
+            self.on_message(server)
+        return "250 OK"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp():
+    handler = Recorder()
+    controller = Controller(handler, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+def _outbox(controller) -> EmailOutbox:
+    return EmailOutbox(host=controller.hostname, port=controller.port, use_ssl=False, username=None,
+                       sender="noreply@example.com", retry_base=0.05, idle_close=5)
+
+
+async def _wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_batch_goes_out_over_one_connection(smtp):
+    async def run():
+        outbox = _outbox(smtp)
+        for i in range(5):
+            await outbox.enqueue(f"user{i}@example.com", "Hi", "body")
+        await _wait_for(lambda: outbox.sent == 5)
+        await outbox.stop()
+        return outbox
+
+    outbox = asyncio.run(run())
+    messages = smtp.handler.messages
+    assert sorted(to for _, to in messages) == [f"user{i}@example.com" for i in range(5)]
+    assert len({peer for peer, _ in messages}) == 1
+    assert outbox.stats()["failed"] == 0
+
+
+def test_failed_reconnect_only_retries_unsent(smtp):
+    """The server drops the connection after the first message and refuses the reconnect."""
+    outbox = _outbox(smtp)
+    up_port = smtp.port
+
+    def drop(server):
+        smtp.handler.on_message = None
+        outbox.port = _free_port()  # nothing listens there
+        server.loop.call_soon(server.transport.close)  # after the 250 has gone out
+
+    smtp.handler.on_message = drop
+
+    async def run():
+        for i in range(3):
+            await outbox.enqueue(f"user{i}@example.com", "Hi", "body")
+        await _wait_for(lambda: outbox.stats()["retrying"] > 0)
+        assert outbox.sent == 1
+        outbox.port = up_port  # server reachable again for the retries
+        await _wait_for(lambda: outbox.sent == 3)
+        await outbox.stop()
+
+    asyncio.run(run())
+    delivered = sorted(to for _, to in smtp.handler.messages)
+    assert delivered == ["user0@example.com", "user1@example.com", "user2@example.com"]
+
+
+# ---------- persisted outbox ----------
+def _persisted(controller, **options) -> EmailOutbox:
+    outbox = _outbox(controller)
+    outbox.persist_collection = AsyncMongoMockClient()["test"]["email_outbox"]
+    for name, value in options.items():
+        setattr(outbox, name, value)
+    return outbox
+
+
+def _orphan(to: str, lease_seconds: float) -> dict:
+    """A message persisted by a worker that died, leased for lease_seconds from now."""
+    now = datetime.utcnow()
+    return {"to": to, "subject": "Your code", "body": "123456", "attempts": 0, "status": "queued",
+            "lease_until": now + timedelta(seconds=lease_seconds), "created_at": now}
+
+
+def test_orphans_are_reclaimed_when_their_lease_expires_not_only_at_start(smtp):
+    outbox = _persisted(smtp, reclaim_interval=0.05)
+
+    async def run():
+        await outbox.persist_collection.insert_one(_orphan("crashed@example.com", lease_seconds=0.3))
+        await outbox.start()  # lease still valid: left alone
+        assert smtp.handler.messages == []
+        await _wait_for(lambda: outbox.sent == 1)
+        assert await outbox.persist_collection.count_documents({}) == 0
+        await outbox.stop()
+
+    asyncio.run(run())
+    assert [to for _, to in smtp.handler.messages] == ["crashed@example.com"]
+
+
+def test_stop_releases_leases_of_unsent_mail(smtp):
+    outbox = _persisted(smtp, port=_free_port(), retry_base=60)  # nothing listens: every send fails
+
+    async def run():
+        await outbox.enqueue("later@example.com", "Hi", "body")
+        await _wait_for(lambda: outbox.stats()["retrying"] == 1)
+        await outbox.stop(timeout=0.1)
+        doc = await outbox.persist_collection.find_one({})
+        assert doc["status"] == "queued" and doc["lease_until"] <= datetime.utcnow()
+
+        # The next worker to start takes it over straight away
+        successor = _outbox(smtp)
+        successor.persist_collection = outbox.persist_collection
+        await successor.start()
+        await _wait_for(lambda: successor.sent == 1)
+        await successor.stop()
+
+    asyncio.run(run())
+    assert [to for _, to in smtp.handler.messages] == ["later@example.com"]
+
+
+def test_outbox_write_errors_do_not_kill_the_worker(smtp):
+    outbox = _persisted(smtp)
+    delete_many = outbox.persist_collection.delete_many
+    calls = []
+
+    async def flaky_delete_many(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("primary stepped down")
+        return await delete_many(*args, **kwargs)
+
+    outbox.persist_collection.delete_many = flaky_delete_many
+
+    async def run():
+        await outbox.enqueue("first@example.com", "Hi", "body")
+        await _wait_for(lambda: outbox.sent == 1 and calls)
+        await outbox.enqueue("second@example.com", "Hi", "body")
+        await _wait_for(lambda: outbox.sent == 2)
+        assert not outbox._worker.done()
+        # The failed delete was retried along with the next one: nothing left to resend
+        await _wait_for(lambda: not outbox._unforgotten)
+        assert await outbox.persist_collection.count_documents({}) == 0
+        await outbox.stop()
+
+    asyncio.run(run())
+    assert [to for _, to in smtp.handler.messages] == ["first@example.com", "second@example.com"]
+
+
+def test_restarted_worker_keeps_the_queued_mail(smtp):
+    outbox = _outbox(smtp)
+
+    async def run():
+        await outbox.start()
+        outbox._worker.cancel()  # the worker dies with mail still queued
+        await asyncio.sleep(0)
+        outbox._queue.put_nowait({"to": "queued@example.com", "subject": "Hi", "body": "body", "attempts": 0})
+        await outbox.enqueue("next@example.com", "Hi", "body")
+        await _wait_for(lambda: outbox.sent == 2)
+        await outbox.stop()
+
+    asyncio.run(run())
+    assert sorted(to for _, to in smtp.handler.messages) == ["next@example.com", "queued@example.com"]
@@ -1,26 +1,199 @@
 # timetable.py
-from fastapi import APIRouter, HTTPException, Query
-from datetime import datetime, timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from datetime import date, datetime, timedelta
+from typing import Optional
 from bson import ObjectId
-import os, uuid
-from dotenv import load_dotenv
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import OperationFailure
+from storage import tenant_collection, ensure_index
+from cache import TTLCache
+import versioning
+import logging
+import os, time, uuid
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
 
-load_dotenv()
 router = APIRouter(prefix="/api/timetable", tags=["Timetable"])
+logger = logging.getLogger(__name__)
 
-MONGO_URI = os.getenv("MONGO_URI")
-client = AsyncIOMotorClient(MONGO_URI)
-db = client["NOTEkiT"]
 
 # --------------------------------------------
 # Utils
 # --------------------------------------------
 def get_template_collection(username: str):
-    return db[f"{username}_templates"]
+    return tenant_collection("templates", username)
 
 def get_streak_collection(username: str):
-    return db[f"{username}_task_streaks"]  # per-task streaks
+    return tenant_collection("streaks", username)  # per-task streaks
+
+# Per-user streak collections from before the unique index have a plain one under the same name
+LEGACY_STREAK_INDEX_NAME = "slot_id_1"
+DUPLICATE_KEY = 11000
+
+async def _fall_back_to_plain_index(streak_coll, keys: list, error: OperationFailure):
+    # Duplicate slot docs from before: serve on a plain index until they are merged
+    logger.warning("unique slot_id index not created on %s: %s", streak_coll.name, error)
+    await ensure_index(streak_coll, keys)
+
+async def ensure_streak_index(streak_coll):
+    # Unique, so two concurrent first marks of a slot can't create two docs.
+    keys = [("slot_id", ASCENDING)]
+    try:
+        await ensure_index(streak_coll, keys, unique=True)
+        return
+    except OperationFailure as e:
+        if e.code == DUPLICATE_KEY:
+            await _fall_back_to_plain_index(streak_coll, keys, e)
+            return
+    # Same name, other options: replace the legacy plain index (as search.py does its old text index)
+    try:
+        await streak_coll.collection.drop_index(LEGACY_STREAK_INDEX_NAME)
+    except OperationFailure:
+        pass  # another request dropped it first
+    try:
+        await ensure_index(streak_coll, keys, unique=True)
+    except OperationFailure as e:
+        await _fall_back_to_plain_index(streak_coll, keys, e)
+
+async def load_streaks(streak_coll, slot_ids: list, years=()) -> dict:
+    """
+    Fetch the streak docs for all given slots in one $in query, keyed by slot_id.
+    History bitsets are only included for the given years.
+    """
+    if not slot_ids:
+        return {}
+    projection = {"_id": 0, "slot_id": 1, "streak": 1, "last_date": 1}
+    projection.update({f"history.y{year}": 1 for year in years})
+    cursor = streak_coll.find({"slot_id": {"$in": slot_ids}}, projection)
+    return {d["slot_id"]: d async for d in cursor}
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+def slots_for_day(template: dict, day: date) -> list:
+    """Resolve a cached template's mode for one date: the constant list, or that weekday's."""
+    return template["by_day"][WEEKDAYS[day.weekday()]]
+
+# --------------------------------------------
+# Completion history
+# Each streak doc keeps history.y<YEAR> = 12 month bitmasks, bit (day - 1)
+# set when the slot was completed that day: at most 12 ints a year per slot.
+# --------------------------------------------
+def history_key(day: date) -> str:
+    return f"y{day.year}"
+
+def completed_on(streak_doc: dict | None, day: date) -> bool:
+    if not streak_doc:
+        return False
+    if streak_doc.get("last_date") == day.isoformat():  # also covers docs from before the history field
+        return True
+    months = (streak_doc.get("history") or {}).get(history_key(day))
+    return bool(months) and bool(int(months[day.month - 1]) >> (day.day - 1) & 1)
+
+def completed_dates(year: int, months: list) -> list:
+    return [
+        date(year, m + 1, d + 1).isoformat()
+        for m, mask in enumerate(months)
+        for d in range(31)
+        if int(mask) >> d & 1
+    ]
+
+def mark_pipeline(slot_id: str, day: date) -> list:
+    """
+    Update pipeline that records a completion atomically:
+    - marking the same day twice changes nothing
+    - the day after last_date extends the streak, a later day restarts it at 1
+    - an earlier (backfilled) day only fills in history and total
+    Bits are tested with arithmetic rather than $bitAnd, which needs MongoDB 6.3.
+    Every mark stamps a version so storage's catch-up copy replaces older copies.
+    """
+    key = f"history.{history_key(day)}"
+    bit = 1 << (day.day - 1)
+    month = day.month - 1
+    months = {"$ifNull": [f"${key}", {"$literal": [0] * 12}]}
+    # 0 or 1; $divide yields a double, so convert back to keep the masks ints
+    already = {"$toInt": {"$mod": [{"$floor": {"$divide": [{"$arrayElemAt": [months, month]}, bit]}}, 2]}}
+    day_str = day.isoformat()
+    yesterday = (day - timedelta(days=1)).isoformat()
+    return [
+        {"$set": {
+            **versioning.version_fields(),
+            "slot_id": {"$literal": slot_id},  # client input: never read as a field path
+            "streak": {"$switch": {
+                "branches": [
+                    {"case": {"$gte": ["$last_date", day_str]}, "then": "$streak"},
+                    {"case": {"$eq": ["$last_date", yesterday]}, "then": {"$add": ["$streak", 1]}},
+                ],
+                "default": 1,
+            }},
+            "last_date": {"$max": ["$last_date", day_str]},
+            "total": {"$add": [{"$ifNull": ["$total", 0]}, 1, {"$multiply": [already, -1]}]},
+            key: {"$map": {
+                "input": {"$literal": list(range(12))},
+                "as": "m",
+                "in": {"$add": [
+                    {"$arrayElemAt": [months, "$$m"]},
+                    {"$cond": [{"$eq": ["$$m", month]}, {"$multiply": [bit, {"$subtract": [1, already]}]}, 0]},
+                ]},
+            }},
+        }},
+        {"$set": {"longest": {"$max": [{"$ifNull": ["$longest", 0]}, "$streak"]}}},
+    ]
+
+# --------------------------------------------
+# Template cache
+# Templates change rarely and only through save_templates, so each worker keeps
+# them in memory with the per-weekday slot lists already resolved. A cached
+# entry is trusted for TEMPLATE_VERSION_CHECK_SECONDS; after that one cheap
+# read (which returns nothing unless the version moved) revalidates it, so
+# saves made on other workers show up within that window. Change streams
+# would need a replica set; this works on any deployment.
+# --------------------------------------------
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "1000"))
+TEMPLATE_CACHE_TTL_SECONDS = float(os.getenv("TEMPLATE_CACHE_TTL_SECONDS", "600"))
+TEMPLATE_VERSION_CHECK_SECONDS = float(os.getenv("TEMPLATE_VERSION_CHECK_SECONDS", "5"))
+
+EMPTY_TEMPLATE = {"mode": "constant", "constant": [], **{day: [] for day in WEEKDAYS}}
+
+# username -> {"version", "doc", "by_day", "checked_at"}; entries are shared, don't mutate them
+template_cache = TTLCache(maxsize=TEMPLATE_CACHE_SIZE, ttl=TEMPLATE_CACHE_TTL_SECONDS)
+
+def _cache_template(username: str, doc: dict | None) -> dict:
+    # What GET /templates serves: the saved fields, without storage bookkeeping
+    body = None
+    if doc is not None:
+        body = {k: v for k, v in doc.items() if k not in ("_id", "owner", "version", "updated_at")}
+    template = body or EMPTY_TEMPLATE
+    if template.get("mode") == "constant":
+        by_day = {day: template.get("constant", []) for day in WEEKDAYS}
+    else:
+        by_day = {day: template.get(day, []) for day in WEEKDAYS}
+    entry = {
+        "version": doc.get("version", 0) if doc else 0,
+        "doc": body,
+        "by_day": by_day,
+        "checked_at": time.monotonic(),
+    }
+    template_cache.set(username, entry)
+    return entry
+
+async def load_template(username: str) -> dict:
+    """The user's template entry ("doc" is None if they never saved one), from cache when possible."""
+    coll = get_template_collection(username)
+    template_id = coll.doc_id("templates")
+    entry = template_cache.get(username)
+    if entry is None:
+        return _cache_template(username, await coll.find_one({"_id": template_id}))
+    if time.monotonic() - entry["checked_at"] < TEMPLATE_VERSION_CHECK_SECONDS:
+        return entry
+    # Fetches the document only if it changed since we cached it; legacy
+    # templates have no version and were cached as version 0
+    changed = await coll.find_one({
+        "_id": template_id,
+        "$expr": {"$ne": [{"$ifNull": ["$version", 0]}, entry["version"]]},
+    })
+    if changed is None:
+        entry["checked_at"] = time.monotonic()
+        return entry
+    return _cache_template(username, changed)
 
 def ensure_slot_id(slot: dict):
     if "slot_id" not in slot or not slot["slot_id"]:
@@ -31,21 +204,16 @@ def ensure_slot_id(slot: dict):
 # GET /templates (load constant + weekday + mode)
 # --------------------------------------------
 @router.get("/templates")
-async def get_templates(username: str = Query(...)):
-    coll = get_template_collection(username)
-    doc = await coll.find_one({"_id": "templates"})
+async def get_templates(request: Request, response: Response, username: str = Query(...)):
+    template = await load_template(username)
 
-    if not doc:
-        # return empty template
-        return {
-            "mode": "constant",
-            "constant": [],
-            "monday": [], "tuesday": [], "wednesday": [],
-            "thursday": [], "friday": [], "saturday": [], "sunday": []
-        }
+    etag = f'W/"{template["version"]}"'
+    if versioning.not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
 
-    doc.pop("_id", None)
-    return doc
+    # empty template if the user never saved one
+    return template["doc"] or EMPTY_TEMPLATE
 
 
 # --------------------------------------------
@@ -61,8 +229,13 @@ async def save_templates(payload: dict, username: str = Query(...)):
             for slot in value:
                 ensure_slot_id(slot)
 
-    payload["_id"] = "templates"
-    await coll.update_one({"_id": "templates"}, {"$set": payload}, upsert=True)
+    template_id = coll.doc_id("templates")
+    payload["_id"] = template_id
+    payload.update(versioning.version_fields())
+    saved = await coll.find_one_and_update(
+        {"_id": template_id}, {"$set": payload}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    _cache_template(username, saved)  # this worker serves the new version right away
 
     return {"message": "templates_saved"}
 
@@ -72,29 +245,23 @@ async def save_templates(payload: dict, username: str = Query(...)):
 # --------------------------------------------
 @router.get("/today")
 async def get_today(username: str = Query(...)):
-    coll = get_template_collection(username)
     streak_coll = get_streak_collection(username)
 
-    doc = await coll.find_one({"_id": "templates"})
-    if not doc:
+    template = await load_template(username)
+    if not template["doc"]:
         return {"mode": "constant", "slots": []}
 
-    mode = doc["mode"]
+    mode = template["doc"]["mode"]
     today = datetime.now().strftime("%Y-%m-%d")
-    weekday = datetime.now().strftime("%A").lower()  # monday, tuesday ...
-
-    if mode == "constant":
-        slots = doc.get("constant", [])
-    else:
-        slots = doc.get(weekday, [])
+    slots = slots_for_day(template, datetime.now().date())
 
-    # attach streak + completed
+    # attach streak + completed (one round trip for all slots)
+    await ensure_streak_index(streak_coll)
+    streaks = await load_streaks(streak_coll, [s["slot_id"] for s in slots])
     enriched = []
 
     for s in slots:
-        slot_id = s["slot_id"]
-
-        streak_doc = await streak_coll.find_one({"slot_id": slot_id})
+        streak_doc = streaks.get(s["slot_id"])
         streak = streak_doc["streak"] if streak_doc else 0
         last_completed = streak_doc["last_date"] if streak_doc else None
 
@@ -110,40 +277,112 @@ async def get_today(username: str = Query(...)):
     }
 
 
+# --------------------------------------------
+# GET /range  (week / month views)
+# --------------------------------------------
+RANGE_MAX_DAYS = int(os.getenv("TIMETABLE_RANGE_MAX_DAYS", "92"))
+
+@router.get("/range")
+async def get_range(
+    username: str = Query(...),
+    start: date = Query(..., description="YYYY-MM-DD, inclusive"),
+    end: date = Query(..., description="YYYY-MM-DD, inclusive"),
+):
+    """
+    The schedule for every date in [start, end] with completion state, from
+    one (usually cached) template read and one streak read. Slot details are listed once under
+    "slots"; each day references them by slot_id.
+    """
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    n_days = (end - start).days + 1
+    if n_days > RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range too long (max {RANGE_MAX_DAYS} days)")
+
+    template = await load_template(username)
+    if not template["doc"]:
+        return {"mode": "constant", "start": start.isoformat(), "end": end.isoformat(), "slots": {}, "days": []}
+
+    days = [start + timedelta(days=i) for i in range(n_days)]
+    per_day = [slots_for_day(template, day) for day in days]
+    slots = {s["slot_id"]: s for day_slots in per_day for s in day_slots if s.get("slot_id")}
+
+    streak_coll = get_streak_collection(username)
+    await ensure_streak_index(streak_coll)
+    streaks = await load_streaks(streak_coll, list(slots), years=sorted({start.year, end.year}))
+
+    return {
+        "mode": template["doc"]["mode"],
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "slots": {
+            slot_id: {**slot, "streak": streaks.get(slot_id, {}).get("streak", 0)}
+            for slot_id, slot in slots.items()
+        },
+        "days": [{
+            "date": day.isoformat(),
+            "slots": [s["slot_id"] for s in day_slots if s.get("slot_id")],
+            "completed": [
+                s["slot_id"] for s in day_slots
+                if s.get("slot_id") and completed_on(streaks.get(s["slot_id"]), day)
+            ],
+        } for day, day_slots in zip(days, per_day)],
+    }
+
+
 # --------------------------------------------
 # POST /mark-complete  (per-task streak)
 # --------------------------------------------
 @router.post("/mark-complete")
 async def mark_complete(payload: dict, username: str = Query(...)):
     slot_id = payload["task_id"]
-    date = payload["date"]
+    try:
+        day = datetime.fromisoformat(payload["date"]).date()
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
 
     streak_coll = get_streak_collection(username)
+    await ensure_streak_index(streak_coll)
 
-    doc = await streak_coll.find_one({"slot_id": slot_id})
-
-    today = datetime.fromisoformat(date).date()
-    yesterday = today - timedelta(days=1)
-
-    if doc:
-        # continue streak if yesterday matched
-        if doc.get("last_date") == yesterday.isoformat():
-            new_streak = doc["streak"] + 1
-        else:
-            new_streak = 1
-    else:
-        new_streak = 1
-
-    await streak_coll.update_one(
+    # One atomic read-modify-write, so concurrent taps can't lose or double-count
+    doc = await streak_coll.find_one_and_update(
         {"slot_id": slot_id},
-        {
-            "$set": {
-                "slot_id": slot_id,
-                "streak": new_streak,
-                "last_date": today.isoformat()
-            }
-        },
-        upsert=True
+        mark_pipeline(slot_id, day),
+        projection={"_id": 0, "streak": 1, "longest": 1, "total": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
     )
 
-    return {"message": "done", "new_streak": new_streak}
+    return {"message": "done", "new_streak": doc["streak"], "longest": doc["longest"], "total": doc["total"]}
+
+
+# --------------------------------------------
+# GET /history  (calendar heatmap data)
+# --------------------------------------------
+@router.get("/history")
+async def get_history(
+    username: str = Query(...),
+    year: Optional[int] = Query(None, ge=1970, le=9999),
+    slot_id: Optional[str] = Query(None, description="one slot; all slots when omitted"),
+):
+    """Completion dates per slot for one year (default: this year), read from the bitsets."""
+    year = year or datetime.now().year
+    key = f"y{year}"
+    streak_coll = get_streak_collection(username)
+    query = {"slot_id": slot_id} if slot_id else {}
+    cursor = streak_coll.find(query, {
+        "_id": 0, "slot_id": 1, "streak": 1, "longest": 1, "total": 1, "last_date": 1, f"history.{key}": 1,
+    })
+    slots = []
+    async for doc in cursor:
+        months = (doc.get("history") or {}).get(key) or [0] * 12
+        slots.append({
+            "slot_id": doc["slot_id"],
+            "streak": doc.get("streak", 0),
+            "longest": doc.get("longest", doc.get("streak", 0)),
+            "total": doc.get("total", 0),
+            "last_date": doc.get("last_date"),
+            "months": months,
+            "dates": completed_dates(year, months),
+        })
+    return {"year": year, "slots": slots}
@@ -1,20 +1,36 @@
 # todos.py
-from fastapi import APIRouter, HTTPException, Query
-from typing import List
-from models import TodoBlockIn, TodoBlock  # adjust import if needed
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from typing import List, Optional
+from datetime import timedelta
+from models import TodoBlockIn, TodoBlock, TodoItemIn, TodoItem, TodoItemPatch, TodoItemOrder, TodoBulkIn  # adjust import if needed
 from bson import ObjectId
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
+from storage import tenant_collection
+import bulk
+import reminders
+import versioning
+from listing import MAX_PAGE_SIZE, fetch_page, parse_fields, pick_fields, projection_for, stream_ndjson, wants_ndjson
+from fast_json import render
 import os
-from dotenv import load_dotenv
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
 
-load_dotenv()
 router = APIRouter(prefix="/api/todos", tags=["Todos"])
 
-MONGO_URI = os.getenv("MONGO_URI")
-if not MONGO_URI:
-    raise RuntimeError("MONGO_URI not set in environment")
-client = AsyncIOMotorClient(MONGO_URI)
-db = client["NOTEkiT"]
+# Serializers below already emit exactly the TodoBlock/TodoItem shapes, so by
+# default responses skip response_model revalidation. Set to 0 to re-enable it.
+TRUSTED_RESPONSES = os.getenv("TODOS_TRUSTED_RESPONSES", "1") == "1"
+
+TODO_FIELDS = {"title", "items"}
+
+
+def item_serializer(item) -> dict:
+    return {
+        "id": int(item.get("id")),
+        "text": item.get("text", ""),
+        "done": bool(item.get("done", False)),
+        "reminderDate": item.get("reminderDate", "") or "",
+        "reminderTime": item.get("reminderTime", "") or ""
+    }
 
 
 def todo_serializer(doc) -> dict:
@@ -22,24 +38,15 @@ def todo_serializer(doc) -> dict:
     return {
         "id": str(doc["_id"]),
         "title": doc.get("title", ""),
-        "items": [
-            {
-                "id": int(item.get("id")),
-                "text": item.get("text", ""),
-                "done": bool(item.get("done", False)),
-                "reminderDate": item.get("reminderDate", "") or "",
-                "reminderTime": item.get("reminderTime", "") or ""
-            }
-            for item in doc.get("items", [])
-        ],
+        "items": list(map(item_serializer, doc.get("items") or [])),
     }
 
 
 def get_user_collection(username: str):
-    """Return per-user todos collection name, validate username."""
+    """Return the todos collection for the user, validate username."""
     if not username:
         raise HTTPException(status_code=400, detail="Username is required in request")
-    return db[f"{username}_todos"]
+    return tenant_collection("todos", username)
 
 
 def _assign_ids_to_items(items: List[dict], starting_id: int = 1) -> List[dict]:
@@ -91,19 +98,122 @@ async def create_todo_block(todo: TodoBlockIn, username: str = Query(...)):
     # convert possible pydantic objects to dicts
     raw_items = [it.dict() if hasattr(it, "dict") else it for it in items_input]
     items_assigned = _assign_ids_to_items(raw_items, starting_id=1)
-    doc = {"title": todo.title or "Untitled List", "items": items_assigned}
-    result = await coll.insert_one(doc)
-    inserted = await coll.find_one({"_id": result.inserted_id})
-    return todo_serializer(inserted)
+    doc = {
+        "title": todo.title or "Untitled List",
+        "items": items_assigned,
+        reminders.REMINDER_COUNT_FIELD: reminders.reminder_count(items_assigned),
+        **versioning.version_fields(),
+    }
+    await coll.insert_one(doc)  # sets doc["_id"]
+    if any(reminders.due_at_for(it) for it in items_assigned):
+        await reminders.sync_block(username, str(doc["_id"]), items_assigned)
+    return render(todo_serializer(doc), TRUSTED_RESPONSES)
 
 
-@router.get("", response_model=List[TodoBlock])
-async def get_all_todo_blocks(username: str = Query(...)):
+@router.post("/bulk")
+async def bulk_todo_blocks(body: TodoBulkIn, username: str = Query(...)):
+    """
+    Apply a batch of block upserts and deletes in one unordered bulk write.
+    An upsert's items (when given) replace the block's list; new blocks without
+    items are seeded with one empty item, like POST /api/todos.
+    Returns one result per operation: created, updated, deleted, not_found or error.
+    """
     coll = get_user_collection(username)
-    blocks = []
-    async for doc in coll.find().sort([("_id", 1)]):
-        blocks.append(todo_serializer(doc))
-    return blocks
+    ids, results = bulk.resolve_ids(body.ops)
+    to_delete = [ids[i] for i, op in enumerate(body.ops) if op.op == "delete" and i not in results]
+    present = await bulk.existing_ids(coll, to_delete)
+
+    requests, new_items = {}, {}
+    for i, op in enumerate(body.ops):
+        if i in results:
+            continue
+        selector = coll.scope({"_id": ids[i]})
+        if op.op == "delete":
+            if ids[i] in present:
+                requests[i] = DeleteOne(selector)
+            else:
+                results[i] = bulk.result(i, ids[i], "not_found")
+            continue
+        update = {"$set": versioning.version_fields(), "$setOnInsert": {}}
+        if op.title:
+            update["$set"]["title"] = op.title
+        else:
+            update["$setOnInsert"]["title"] = "Untitled List"
+        if op.items is not None:
+            new_items[i] = _assign_ids_to_items([it.dict() for it in op.items], starting_id=1)
+            update["$set"]["items"] = new_items[i]
+            update["$set"][reminders.REMINDER_COUNT_FIELD] = reminders.reminder_count(new_items[i])
+        else:
+            update["$setOnInsert"]["items"] = _assign_ids_to_items([{}], starting_id=1)
+            update["$setOnInsert"][reminders.REMINDER_COUNT_FIELD] = 0
+        if not update["$setOnInsert"]:
+            del update["$setOnInsert"]
+        requests[i] = UpdateOne(selector, update, upsert=True)
+
+    upserted, errors = await bulk.execute(coll, requests)
+    deleted, synced = [], {}
+    for i in requests:
+        if i in errors:
+            results[i] = bulk.result(i, ids[i], "error", errors[i])
+        elif body.ops[i].op == "delete":
+            results[i] = bulk.result(i, ids[i], "deleted")
+            deleted.append(str(ids[i]))
+        else:
+            results[i] = bulk.result(i, ids[i], "created" if i in upserted else "updated")
+            if i in new_items:
+                synced[str(ids[i])] = new_items[i]
+
+    await versioning.record_deletions(username, "todo", deleted)
+    await reminders.remove_blocks(username, deleted)
+    await reminders.sync_blocks(username, synced)
+    return render({"results": [results[i] for i in range(len(body.ops))]}, TRUSTED_RESPONSES)
+
+
+# No response_model here: with ?fields= the blocks are deliberately partial
+@router.get("")
+async def get_all_todo_blocks(
+    request: Request,
+    response: Response,
+    username: str = Query(...),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    fields: Optional[str] = Query(None, description="comma-separated, e.g. title"),
+):
+    coll = get_user_collection(username)
+    wanted = parse_fields(fields, TODO_FIELDS)
+    etag = await versioning.collection_etag(coll, request)
+    if versioning.not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    if wants_ndjson(request):
+        streamed = stream_ndjson(coll, todo_serializer, after, wanted)
+        streamed.headers["ETag"] = etag
+        return streamed
+    if limit is not None or after is not None:
+        page = await fetch_page(coll, todo_serializer, limit or MAX_PAGE_SIZE, after, wanted)
+        return render(page, TRUSTED_RESPONSES, headers={"ETag": etag})
+
+    cursor = coll.find({}, projection_for(wanted)).sort([("_id", 1)])
+    blocks = [pick_fields(todo_serializer(doc), wanted) async for doc in cursor]
+    return render(blocks, TRUSTED_RESPONSES, headers={"ETag": etag})
+
+
+@router.get("/reminders/upcoming")
+async def get_upcoming_reminders(
+    username: str = Query(...),
+    hours: int = Query(24, ge=1, le=24 * 31),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Reminders due in the next `hours`, soonest first, served from the due_at index."""
+    get_user_collection(username)  # validates username
+    docs = await reminders.upcoming(username, timedelta(hours=hours), limit)
+    return [{
+        "blockId": d["block_id"],
+        "itemId": d["item_id"],
+        "text": d.get("text", ""),
+        "dueAt": d["due_at"].isoformat() + "Z",
+        "fired": d.get("fired", False),
+    } for d in docs]
 
 
 @router.get("/{id}", response_model=TodoBlock)
@@ -112,59 +222,83 @@ async def get_todo_block(id: str, username: str = Query(...)):
     doc = await coll.find_one({"_id": ObjectId(id)})
     if not doc:
         raise HTTPException(status_code=404, detail=f"Todo block not found with id {id}")
-    return todo_serializer(doc)
+    return render(todo_serializer(doc), TRUSTED_RESPONSES)
 
 
 @router.put("/{id}", response_model=TodoBlock)
 async def update_todo_block(id: str, updated: TodoBlockIn, username: str = Query(...)):
+    """
+    Replace a block's title and items in a single round trip.
+    New items (no id) get ids above both the incoming ids and the ids already
+    stored; the stored max is read inside the update pipeline, not beforehand.
+    The reminder index is only written when the old or the new list has a
+    reminder, so most saves stay a single round trip.
+    """
     coll = get_user_collection(username)
-    existing = await coll.find_one({"_id": ObjectId(id)})
-    if not existing:
-        raise HTTPException(status_code=404, detail=f"Todo block not found with id {id}")
-
-    existing_items = existing.get("items", []) or []
-    existing_max_id = 0
-    for it in existing_items:
-        try:
-            existing_max_id = max(existing_max_id, int(it.get("id", 0)))
-        except Exception:
-            continue
 
     incoming = updated.items or []
     incoming_raw = [it.dict() if hasattr(it, "dict") else it for it in incoming]
 
-    with_ids = [it for it in incoming_raw if it.get("id") is not None]
-    without_ids = [it for it in incoming_raw if it.get("id") is None]
-
-    normalized_with_ids = [{
-        "id": int(it["id"]),
-        "text": it.get("text", "") or "",
-        "done": bool(it.get("done", False)),
-        "reminderDate": it.get("reminderDate", "") or "",
-        "reminderTime": it.get("reminderTime", "") or ""
-    } for it in with_ids]
-
-    max_existing_or_incoming = existing_max_id
-    for it in normalized_with_ids:
-        if it["id"] > max_existing_or_incoming:
-            max_existing_or_incoming = it["id"]
+    # Items keep the client's order (the same order reorder_todo_items writes).
+    # New items (no id) carry an offset 1..n here instead; the pipeline adds
+    # max(stored, incoming) to it.
+    items = []
+    offset = 0
+    for it in incoming_raw:
+        item = {
+            "text": it.get("text", "") or "",
+            "done": bool(it.get("done", False)),
+            "reminderDate": it.get("reminderDate", "") or "",
+            "reminderTime": it.get("reminderTime", "") or ""
+        }
+        if it.get("id") is not None:
+            item["id"] = int(it["id"])
+        else:
+            offset += 1
+            item["offset"] = offset
+        items.append(item)
 
-    assigned_new = _assign_ids_to_items(without_ids, starting_id=max_existing_or_incoming + 1)
+    incoming_max_id = max((it["id"] for it in items if "id" in it), default=0)
 
-    final_items = normalized_with_ids + assigned_new
-    final_items = sorted(final_items, key=lambda x: x["id"])
+    if updated.title:
+        title_expr = {"$literal": updated.title}
+    else:
+        title_expr = {"$ifNull": ["$title", "Untitled List"]}
 
-    update_doc = {
-        "title": updated.title or existing.get("title", "Untitled List"),
-        "items": final_items
-    }
+    pipeline = [{"$set": {
+        **versioning.version_fields(),
+        "title": title_expr,
+        "items": {"$let": {
+            "vars": {"base": {"$max": [incoming_max_id, {"$ifNull": [{"$max": "$items.id"}, 0]}]}},
+            "in": {"$map": {
+                "input": {"$literal": items},
+                "as": "it",
+                "in": {
+                    "id": {"$ifNull": ["$$it.id", {"$add": ["$$base", "$$it.offset"]}]},
+                    "text": "$$it.text",
+                    "done": "$$it.done",
+                    "reminderDate": "$$it.reminderDate",
+                    "reminderTime": "$$it.reminderTime",
+                },
+            }},
+        }},
+    }}, {"$set": {reminders.REMINDER_COUNT_FIELD: reminders.REMINDER_COUNT}}]
 
-    result = await coll.update_one({"_id": ObjectId(id)}, {"$set": update_doc})
-    if result.matched_count == 0:
+    new_doc = None
+    if reminders.reminder_count(items) == 0:
+        # Matches only if the stored list had no reminders either: nothing to sync
+        new_doc = await coll.find_one_and_update(
+            {"_id": ObjectId(id), reminders.REMINDER_COUNT_FIELD: 0}, pipeline, return_document=ReturnDocument.AFTER
+        )
+        if new_doc:
+            return render(todo_serializer(new_doc), TRUSTED_RESPONSES)
+    new_doc = await coll.find_one_and_update(
+        {"_id": ObjectId(id)}, pipeline, return_document=ReturnDocument.AFTER
+    )
+    if not new_doc:
         raise HTTPException(status_code=404, detail=f"Todo block not found with id {id}")
-
-    new_doc = await coll.find_one({"_id": ObjectId(id)})
-    return todo_serializer(new_doc)
+    await reminders.sync_block(username, id, new_doc.get("items", []))
+    return render(todo_serializer(new_doc), TRUSTED_RESPONSES)
 
 
 @router.delete("/{id}")
@@ -173,5 +307,118 @@ async def delete_todo_block(id: str, username: str = Query(...)):
     result = await coll.delete_one({"_id": ObjectId(id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail=f"Todo block not found with id {id}")
+    await versioning.record_deletion(username, "todo", id)
+    await reminders.remove_block(username, id)
     return {"message": f"Todo block {id} deleted successfully"}
 
+
+
+# ================= Item-level operations =================
+# Each of these is one atomic write touching only the affected item, so a
+# single tick doesn't rewrite (or ship back) the whole list.
+
+@router.post("/{id}/items", response_model=TodoItem)
+async def add_todo_item(id: str, item: TodoItemIn, username: str = Query(...)):
+    """Append an item; its id is assigned server-side as max(existing ids) + 1."""
+    coll = get_user_collection(username)
+    new_item = {
+        "text": item.text or "",
+        "done": bool(item.done),
+        "reminderDate": item.reminderDate or "",
+        "reminderTime": item.reminderTime or "",
+    }
+    pipeline = [{"$set": {**versioning.version_fields(), "items": {"$concatArrays": [
+        {"$ifNull": ["$items", []]},
+        {"$map": {
+            "input": {"$literal": [new_item]},
+            "as": "it",
+            "in": {
+                "id": {"$add": [{"$ifNull": [{"$max": "$items.id"}, 0]}, 1]},
+                "text": "$$it.text",
+                "done": "$$it.done",
+                "reminderDate": "$$it.reminderDate",
+                "reminderTime": "$$it.reminderTime",
+            },
+        }},
+    ]}}}, {"$set": {reminders.REMINDER_COUNT_FIELD: reminders.REMINDER_COUNT}}]
+    doc = await coll.find_one_and_update(
+        {"_id": ObjectId(id)}, pipeline,
+        projection={"items": {"$slice": -1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail=f"Todo block not found with id {id}")
+    added = doc["items"][-1]
+    if reminders.due_at_for(added):
+        await reminders.sync_item(username, id, added)
+    return render(item_serializer(added), TRUSTED_RESPONSES)
+
+
+@router.patch("/{id}/items/{item_id}", response_model=TodoItem)
+async def update_todo_item(id: str, item_id: int, patch: TodoItemPatch, username: str = Query(...)):
+    """Toggle or edit one item in place via an array filter."""
+    coll = get_user_collection(username)
+    changes = {k: v for k, v in patch.dict().items() if v is not None}
+    if not changes:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    update = {"$set": {**{f"items.$[elem].{k}": v for k, v in changes.items()}, **versioning.version_fields()}}
+    if changes.keys() & {"reminderDate", "done"}:
+        update["$unset"] = {reminders.REMINDER_COUNT_FIELD: ""}  # may have changed; the next full save recounts
+    doc = await coll.find_one_and_update(
+        {"_id": ObjectId(id), "items.id": item_id},
+        update,
+        array_filters=[{"elem.id": item_id}],
+        projection={"items": {"$elemMatch": {"id": item_id}}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not doc or not doc.get("items"):
+        raise HTTPException(status_code=404, detail=f"Todo item {item_id} not found in block {id}")
+    item = doc["items"][0]
+    if reminders.due_at_for(item) or changes.keys() & {"reminderDate", "reminderTime", "done"}:
+        await reminders.sync_item(username, id, item)
+    return render(item_serializer(item), TRUSTED_RESPONSES)
+
+
+@router.delete("/{id}/items/{item_id}")
+async def delete_todo_item(id: str, item_id: int, username: str = Query(...)):
+    coll = get_user_collection(username)
+    result = await coll.update_one(
+        {"_id": ObjectId(id), "items.id": item_id},
+        {"$pull": {"items": {"id": item_id}}, "$set": versioning.version_fields()},
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail=f"Todo item {item_id} not found in block {id}")
+    await reminders.remove_item(username, id, item_id)
+    return {"message": f"Todo item {item_id} deleted successfully"}
+
+
+@router.put("/{id}/items/order", response_model=TodoBlock)
+async def reorder_todo_items(id: str, body: TodoItemOrder, username: str = Query(...)):
+    """
+    Reorder items server-side in one write. Ids missing from the order keep
+    their relative order after the listed ones; unknown ids are ignored.
+    A later full PUT keeps whatever order the client sends.
+    """
+    coll = get_user_collection(username)
+    order = {"$literal": list(dict.fromkeys(body.order))}  # drop repeated ids
+    pipeline = [{"$set": {**versioning.version_fields(), "items": {"$concatArrays": [
+        {"$filter": {
+            "input": {"$map": {
+                "input": order,
+                "as": "wanted",
+                "in": {"$arrayElemAt": [
+                    {"$filter": {"input": "$items", "as": "it", "cond": {"$eq": ["$$it.id", "$$wanted"]}}},
+                    0,
+                ]},
+            }},
+            "as": "found",
+            "cond": {"$ne": [{"$ifNull": ["$$found", None]}, None]},
+        }},
+        {"$filter": {"input": "$items", "as": "it", "cond": {"$eq": [{"$in": ["$$it.id", order]}, False]}}},
+    ]}}}]
+    doc = await coll.find_one_and_update(
+        {"_id": ObjectId(id)}, pipeline, return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail=f"Todo block not found with id {id}")
+    return render(todo_serializer(doc), TRUSTED_RESPONSES)
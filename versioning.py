@@ -0,0 +1,91 @@
+# versioning.py
+# Change tracking for incremental sync. Every note, todo block and timetable
+# template carries a "version" (microseconds since the epoch, strictly
+# increasing per worker) and "updated_at"; deletions leave a tombstone in the
+# shared sync_tombstones collection, which expires after TOMBSTONE_TTL_DAYS.
+# Also builds the cheap ETags used for conditional GETs on list endpoints.
+import hashlib
+import os
+import time
+from datetime import datetime
+import settings  # noqa: F401 - loads .env before the os.getenv reads below
+from fastapi import Request
+from pymongo import ASCENDING, DESCENDING
+from database import get_app_db
+from storage import ensure_index
+import indexes
+import storage
+
+TOMBSTONES_COLLECTION = storage.TOMBSTONES_COLLECTION
+TOMBSTONE_TTL_DAYS = int(os.getenv("TOMBSTONE_TTL_DAYS", "30"))
+indexes.declare("app", TOMBSTONES_COLLECTION, [("owner", ASCENDING), ("version", ASCENDING)])
+indexes.declare("app", TOMBSTONES_COLLECTION, "deleted_at", expireAfterSeconds=TOMBSTONE_TTL_DAYS * 86400)
+
+_last_version = 0
+
+
+def next_version() -> int:
+    global _last_version
+    _last_version = max(_last_version + 1, time.time_ns() // 1000)
+    return _last_version
+
+
+def version_fields() -> dict:
+    """Fields to $set (or merge into a new document) on every write."""
+    return {"version": next_version(), "updated_at": datetime.utcnow()}
+
+
+def oldest_retained_version() -> int:
+    """Versions older than this may have lost their tombstones; clients must resync fully."""
+    return int((time.time() - TOMBSTONE_TTL_DAYS * 86400) * 1_000_000)
+
+
+def get_tombstones_collection():
+    return get_app_db()[TOMBSTONES_COLLECTION]
+
+
+async def record_deletion(owner: str, kind: str, doc_id: str):
+    fields = version_fields()
+    await get_tombstones_collection().insert_one({
+        "owner": owner, "kind": kind, "id": doc_id,
+        "version": fields["version"], "deleted_at": fields["updated_at"],
+    })
+
+
+async def record_deletions(owner: str, kind: str, doc_ids: list):
+    """Tombstones for a batch of deletions, in one insert."""
+    if not doc_ids:
+        return
+    fields = version_fields()
+    await get_tombstones_collection().insert_many([{
+        "owner": owner, "kind": kind, "id": doc_id,
+        "version": fields["version"], "deleted_at": fields["updated_at"],
+    } for doc_id in doc_ids])
+
+
+async def ensure_version_index(coll) -> list:
+    return await ensure_index(coll, [("version", ASCENDING)])
+
+
+# ================= ETags =================
+async def collection_etag(coll, request: Request) -> str:
+    """
+    Weak ETag for a user's list: document count + highest version, plus the
+    query string and Accept header (pages, projections and formats differ).
+    Both come off the version index, in two small queries that read no
+    documents: the highest key, and a count over all keys.
+    """
+    keys = await ensure_version_index(coll)
+    latest = await coll.find({}, {"_id": 0, "version": 1}).sort("version", DESCENDING).limit(1).to_list(length=1)
+    n = await coll.count_documents({}, hint=keys)
+    v = (latest[0].get("version") or 0) if latest else 0
+    variant = str(sorted(request.query_params.multi_items())) + request.headers.get("accept", "")
+    query = hashlib.sha1(variant.encode()).hexdigest()[:12]
+    return f'W/"{n}-{v}-{query}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [t.strip() for t in header.split(",")]